@@ -1,6 +1,5 @@
 from typing import *
 
-import pandas as pd
 from click.exceptions import ClickException
 from typer_cloup import *
 
@@ -17,8 +16,6 @@ app.add_sub(tree_cmd.app)
 app.add_sub(snp_cmd.app)
 app.add_sub(str_cmd.app)
 
-pd.options.mode.chained_assignment = None
-
 
 @ftdna_cmd.app.callback()
 def ftdna() -> None:
@@ -4,7 +4,6 @@ from datetime import datetime, timezone
 from pathlib import Path
 from typing import *
 
-import mechanicalsoup
 from platformdirs import PlatformDirs
 from typer_cloup import *
 
@@ -35,17 +34,3 @@ def cache_dir() -> Path:
     return path
 
 
-def _form_choose_submit_none(form: mechanicalsoup.Form):
-    buttons = (
-        button
-        for button in form.form.select("input[type='submit' i], button")
-        if button.get("type", "").lower() not in ("button", "reset")
-    )
-
-    for button in buttons:
-        del button["name"]
-
-    form._submit_chosen = True
-
-
-mechanicalsoup.Form.choose_submit_none = _form_choose_submit_none
@@ -1,8 +1,14 @@
-from itertools import takewhile
+import json
+import pickle
+import shutil
+from collections import deque
 from pathlib import Path
 from typing import *
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from platformdirs import PlatformDirs
 
 from .common import *
@@ -26,11 +32,17 @@ def float_and(a: NDFrameT, b: NDFrameT) -> NDFrameT:
 
 
 def float_or(a: NDFrameT, b: NDFrameT) -> NDFrameT:
-    return float_not(float_and(float_not(a.fillna(0)), float_not(b.fillna(0))))
+    # On the {0, 1, NaN} domain used throughout, inclusive-or of NaN-filled
+    # operands reduces to a single fused element-wise maximum, instead of the
+    # five intermediate frames of `1 - (1 - a)(1 - b)`.
+    return cast(NDFrameT, np.fmax(a.fillna(0), b.fillna(0)))
 
 
 def float_xor(a: NDFrameT, b: NDFrameT) -> NDFrameT:
-    return float_and(float_or(a, b), float_not(float_and(a, b)))
+    # On {0, 1} exclusive-or is |a - b|, and NaN still propagates through the
+    # subtraction; one fused pass instead of the and/or/not composition's
+    # four intermediate frames.
+    return cast(NDFrameT, np.abs(a - b))
 
 
 def float_isna(a: NDFrameT) -> NDFrameT:
@@ -41,66 +53,522 @@ def float_notna(a: NDFrameT) -> NDFrameT:
     return a.notna().astype("float16", copy=False)
 
 
-def load_db(path: GenericPath) -> pd.DataFrame:
+def bool_and(a: NDFrameT, b: NDFrameT) -> NDFrameT:
+    return cast(NDFrameT, a & b)
+
+
+def bool_or(a: NDFrameT, b: NDFrameT) -> NDFrameT:
+    return cast(NDFrameT, a.fillna(False) | b.fillna(False))
+
+
+def bool_xor(a: NDFrameT, b: NDFrameT) -> NDFrameT:
+    return cast(NDFrameT, a.astype("boolean") ^ b.astype("boolean"))
+
+
+def bool_isna(a: NDFrameT) -> NDFrameT:
+    return cast(NDFrameT, a.isna())
+
+
+def bool_notna(a: NDFrameT) -> NDFrameT:
+    return cast(NDFrameT, a.notna())
+
+
+# Number of fragments a database may accumulate before `merge_db` compacts
+# it back into a single file.
+db_compact_threshold = 16
+
+
+def _db_fragment_paths(path: Path) -> List[Path]:
+    return sorted(path.glob("part-*.parquet"))
+
+
+def _schema_index_column(schema: pa.Schema) -> Optional[str]:
+    metadata = schema.metadata or {}
+    pandas_metadata = metadata.get(b"pandas")
+    if pandas_metadata is None:
+        return None
+
+    index_columns = json.loads(pandas_metadata).get("index_columns", [])
+    if len(index_columns) == 1 and isinstance(index_columns[0], str):
+        if index_columns[0] in schema.names:
+            return index_columns[0]
+
+    return None
+
+
+def _read_fragment(
+    path: Path, columns: Optional[Sequence[str]], schema: Optional[pa.Schema] = None
+) -> pa.Table:
+    if columns is None:
+        return pq.read_table(path, memory_map=True)
+
+    # Parquet is columnar, so restricting the read to the requested columns
+    # (plus the index) skips I/O and decode for everything else.
+    if schema is None:
+        schema = pq.read_schema(path)
+    read_columns = [col for col in columns if col in schema.names]
+    index_column = _schema_index_column(schema)
+    if index_column is not None and index_column not in read_columns:
+        read_columns.append(index_column)
+
+    return pq.read_table(path, columns=read_columns, memory_map=True)
+
+
+def _write_db_metadata(path: Path) -> None:
+    """Write a `_metadata` sidecar summarizing every fragment's footer.
+
+    With the sidecar in place, readers learn the fragment directory's schema
+    from a single footer read instead of one per fragment.
+    """
+
+    fragment_paths = _db_fragment_paths(path)
+    if not fragment_paths:
+        return
+
+    schema: Optional[pa.Schema] = None
+    metadata_collector = []
+    try:
+        for fragment in fragment_paths:
+            fragment_schema = pq.read_schema(fragment)
+            if schema is None:
+                schema = fragment_schema
+            elif not schema.equals(fragment_schema):
+                # Fragments with diverging schemas cannot share a sidecar.
+                (path / "_metadata").unlink(missing_ok=True)
+                return
+
+            metadata = pq.read_metadata(fragment)
+            metadata.set_file_path(fragment.name)
+            metadata_collector.append(metadata)
+
+        pq.write_metadata(
+            schema, path / "_metadata", metadata_collector=metadata_collector
+        )
+    except (OSError, pa.ArrowInvalid):
+        pass
+
+
+def _read_db_metadata(
+    path: Path, fragment_paths: Sequence[Path]
+) -> Optional[pa.Schema]:
+    try:
+        metadata = pq.read_metadata(path / "_metadata")
+        file_paths = {
+            metadata.row_group(i).column(0).file_path
+            for i in range(metadata.num_row_groups)
+        }
+    except (FileNotFoundError, OSError, pa.ArrowInvalid, IndexError):
+        return None
+
+    # Only trust a sidecar that covers exactly the current fragments.
+    if file_paths != {fragment.name for fragment in fragment_paths}:
+        return None
+
+    return metadata.schema.to_arrow_schema()
+
+
+def _table_keep_last(table: pa.Table, key: str) -> pa.Table:
+    # Keep the last row per key, preserving row order — the Arrow equivalent
+    # of `df[~df.index.duplicated(keep="last")]`, over typed buffers.
+    row_numbers = pa.array(np.arange(len(table), dtype=np.int64))
+    last_rows = (
+        pa.table({"key": table.column(key), "row": row_numbers})
+        .group_by("key")
+        .aggregate([("row", "max")])
+    )
+    return table.take(pa.array(np.sort(last_rows.column("row_max").to_numpy())))
+
+
+def load_db(
+    path: GenericPath, columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    path = Path(path)
+
     try:
-        return pd.read_parquet(path)
+        if path.is_dir():
+            fragment_paths = _db_fragment_paths(path)
+            if not fragment_paths:
+                return None
+
+            # Later fragments supersede earlier ones; deduplicate in Arrow
+            # before materializing a pandas frame.
+            schema = _read_db_metadata(path, fragment_paths)
+            table = pa.concat_tables(
+                [
+                    _read_fragment(fragment, columns, schema)
+                    for fragment in fragment_paths
+                ],
+                promote_options="permissive",
+            )
+            index_column = _schema_index_column(table.schema)
+            if index_column is not None:
+                table = _table_keep_last(table, index_column)
+                df = table.to_pandas()
+            else:
+                df = table.to_pandas()
+                df = df[~df.index.duplicated(keep="last")]
+        else:
+            # Memory-map the file so Arrow decodes column chunks straight
+            # from the page cache instead of copying the file into a buffer
+            # first.
+            df = pd.read_parquet(path, columns=columns, memory_map=True)
     except (FileNotFoundError, pd.errors.EmptyDataError):
         return None
 
+    # Haplogroup names are low-cardinality strings shared across many rows;
+    # categoricals make lookups and comparisons work on integer codes.
+    for col in ("Haplogroup", "Parent Haplogroup"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    # Back the remaining string columns with Arrow buffers: comparisons,
+    # isin, and dedup then run on Arrow compute kernels rather than
+    # per-object Python equality. Columns holding non-string payloads (such
+    # as SNP lists) are left alone.
+    for col in df.columns:
+        values = df[col]
+        if values.dtype != object:
+            continue
+
+        notna = values.notna()
+        if notna.any() and isinstance(values.iloc[int(notna.values.argmax())], str):
+            df[col] = values.astype("string[pyarrow]")
+
+    return df
+
+
+def _stringify_categories(df: pd.DataFrame) -> pd.DataFrame:
+    # Loaded frames carry categorical haplogroup columns (see load_db), which
+    # parquet would persist as a dictionary type. Fragments written from fresh
+    # frames hold plain strings, and concat_tables refuses to merge the two
+    # schemas — so always write categoricals back as strings.
+    category_columns = [
+        col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)
+    ]
+    if not category_columns:
+        return df
+
+    df = df.copy(deep=False)
+    for col in category_columns:
+        df[col] = df[col].astype("string")
+
+    return df
+
 
 def store_db(path: GenericPath, df: pd.DataFrame) -> None:
-    df.to_parquet(path)
+    path = Path(path)
+    if path.is_dir():
+        delete_db(path)
+
+    df = _stringify_categories(df)
+
+    # Store rows in index order with modest row groups: parquet then carries
+    # min/max statistics per row group that let readers skip irrelevant ones,
+    # and load-time dedup scans mostly-sorted keys.
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind="mergesort")
+
+    df.to_parquet(path, compression="zstd", row_group_size=50_000)
 
 
 def merge_db(path: GenericPath, new_df: pd.DataFrame) -> None:
-    df = load_db(path)
-    if df is None:
-        df = new_df
+    # Append the new rows as a fresh parquet fragment rather than rewriting
+    # the whole database; duplicates are resolved at load time and the
+    # fragments are compacted once there are enough of them.
+    path = Path(path)
+
+    if path.is_file():
+        # Convert the legacy single-file layout to a fragment directory.
+        legacy_path = path.rename(path.with_name(path.name + ".legacy"))
+        path.mkdir()
+        legacy_path.rename(path / "part-00000000.parquet")
+    elif not path.exists():
+        path.mkdir(parents=True)
+
+    fragment_paths = _db_fragment_paths(path)
+    if fragment_paths:
+        next_index = int(fragment_paths[-1].stem.removeprefix("part-")) + 1
     else:
-        # Add new rows, removing old duplicates.
-        df = pd.concat([df, new_df], axis=0)
-        df = df[~df.index.duplicated(keep="last")]
+        next_index = 0
 
-    store_db(path, df)
+    new_df = _stringify_categories(new_df)
+    new_df.to_parquet(path / f"part-{next_index:08d}.parquet", compression="zstd")
+
+    if len(fragment_paths) + 1 >= db_compact_threshold:
+        compact_db(path)
+    else:
+        _write_db_metadata(path)
+
+
+def compact_db(path: GenericPath) -> None:
+    df = load_db(path)
+    if df is not None:
+        store_db(path, df)
 
 
 def delete_db(path: GenericPath) -> None:
-    Path(path).unlink(missing_ok=True)
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
 
 
-def get_haplogroup_lineage(tree_df: pd.DataFrame, haplogroup: str) -> List[str]:
-    lineage = []
-    cur_hg = haplogroup
-    while pd.notna(cur_hg):
-        lineage.append(cur_hg)
+_parent_map_tree_id: Optional[int] = None
+_parent_map: Dict[str, str] = {}
+_lineage_cache: Dict[str, List[str]] = {}
+
+
+def get_parent_map(tree_df: pd.DataFrame) -> Dict[str, str]:
+    global _parent_map_tree_id, _parent_map, _lineage_cache
+
+    if _parent_map_tree_id != id(tree_df):
+        # Materialize the parent relation as a plain dict once per tree,
+        # so lineage walks avoid per-step `.loc` lookups.
+        parents = tree_df["Parent Haplogroup"]
+        _parent_map = {
+            hg: parent for hg, parent in zip(tree_df.index, parents) if pd.notna(parent)
+        }
+        _lineage_cache = {}
+        _parent_map_tree_id = id(tree_df)
+
+    return _parent_map
+
+
+def _tree_db_stat() -> Optional[Tuple[int, int]]:
+    path = Path(tree_path)
+    try:
+        if path.is_dir():
+            stats = [fragment.stat() for fragment in _db_fragment_paths(path)]
+            if not stats:
+                return None
+            return (
+                max(stat.st_mtime_ns for stat in stats),
+                sum(stat.st_size for stat in stats),
+            )
+
+        stat = path.stat()
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def load_tree_db() -> Optional[pd.DataFrame]:
+    """Load the tree database, restoring the parent map from a disk cache.
+
+    Unpickling the parent map is much cheaper than rebuilding it from the
+    parquet columns, so warm CLI starts skip that step. The cache is keyed
+    by the tree database's mtime and size and rebuilt when stale.
+    """
+
+    global _parent_map, _parent_map_tree_id, _lineage_cache
+
+    tree_df = load_db(tree_path)
+    if tree_df is None:
+        return None
+
+    cache_path = cache_dir() / "tree-parent-map.pkl"
+    stat = _tree_db_stat()
+
+    cached = None
+    try:
+        with open(cache_path, "rb") as file:
+            cached = pickle.load(file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+
+    if cached is not None and cached.get("stat") == stat:
+        _parent_map = cached["parent_map"]
+        _lineage_cache = {}
+        _parent_map_tree_id = id(tree_df)
+    else:
+        get_parent_map(tree_df)
         try:
-            cur_hg = tree_df.loc[cur_hg, "Parent Haplogroup"]
-        except KeyError:
-            break
+            with open(cache_path, "wb") as file:
+                pickle.dump({"stat": stat, "parent_map": _parent_map}, file)
+        except OSError:
+            pass
 
-    return lineage
+    return tree_df
+
+
+def prime_lineage_cache(tree_df: pd.DataFrame, haplogroups: Iterable[str]) -> None:
+    """Compute lineages for many haplogroups at once.
+
+    Each round maps the whole frontier to its parents in one index-aligned
+    `Series.map`, so the number of vectorized steps is bounded by tree depth
+    rather than doing a Python walk per haplogroup.
+    """
+
+    parent_map = get_parent_map(tree_df)
+    pending = [
+        hg for hg in haplogroups if pd.notna(hg) and hg not in _lineage_cache
+    ]
+    if not pending:
+        return
+
+    parent_s = pd.Series(parent_map, dtype="object")
+    levels = []
+    cur = pd.Series(pending, dtype="object")
+    while cur.notna().any():
+        levels.append(cur.to_numpy(dtype=object))
+        cur = cur.map(parent_s)
+
+    matrix = np.column_stack(levels)
+    for i, hg in enumerate(pending):
+        _lineage_cache[hg] = [x for x in matrix[i] if pd.notna(x)]
+
+
+def get_haplogroup_lineage(tree_df: pd.DataFrame, haplogroup: str) -> List[str]:
+    parent_map = get_parent_map(tree_df)
+
+    if pd.isna(haplogroup):
+        return []
+
+    lineage = _lineage_cache.get(haplogroup)
+    if lineage is None:
+        lineage = [haplogroup]
+        cur_hg = haplogroup
+        while (parent_hg := parent_map.get(cur_hg)) is not None:
+            # Splice in an already-computed ancestor lineage rather than
+            # re-walking the shared upper part of the tree.
+            cached = _lineage_cache.get(parent_hg)
+            if cached is not None:
+                lineage.extend(cached)
+                break
+
+            lineage.append(parent_hg)
+            cur_hg = parent_hg
+
+        # Cache each suffix too, so future walks from any ancestor on this
+        # path are single dict hits.
+        for i, hg in enumerate(lineage):
+            _lineage_cache.setdefault(hg, lineage[i:])
+
+    return list(lineage)
+
+
+class TreeIndex(NamedTuple):
+    """Integer-coded view of the haplogroup tree.
+
+    Haplogroups are numbered in topological order, so every parent has a
+    smaller code than its children. `depth` holds each haplogroup's lineage
+    length, and for small enough trees `ancestor_mask` packs each
+    haplogroup's ancestor-or-self set into a row of 64-bit words aligned to
+    the codes, making lineage tests pure integer arithmetic.
+    """
+
+    codes: Dict[str, int]
+    depth: np.ndarray
+    ancestor_mask: Optional[np.ndarray]
+
+
+# Largest tree for which the dense ancestor bit-matrix is built; it takes
+# N^2 / 8 bytes, so 16K haplogroups come to 32 MB.
+tree_index_max_bitmask_nodes = 16_384
+
+_tree_index_tree_id: Optional[int] = None
+_tree_index: Optional[TreeIndex] = None
+
+_popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def get_tree_index(tree_df: pd.DataFrame) -> TreeIndex:
+    global _tree_index_tree_id, _tree_index
+
+    if _tree_index_tree_id == id(tree_df):
+        return cast(TreeIndex, _tree_index)
+
+    parent_map = get_parent_map(tree_df)
+    haplogroups = set(tree_df.index)
+
+    # A pruned tree can keep parent names whose own rows were dropped. Code
+    # those dangling ancestors as pseudo-root nodes, so depths and ancestor
+    # masks line up with the lineages get_haplogroup_lineage produces (which
+    # include the dangling parent as the final step of the walk).
+    dangling: Set[str] = set()
+    children: Dict[str, List[str]] = {}
+    roots = []
+    for hg in tree_df.index:
+        parent = parent_map.get(hg)
+        if parent is None:
+            roots.append(hg)
+        else:
+            if parent not in haplogroups and parent not in dangling:
+                dangling.add(parent)
+                roots.append(parent)
+
+            children.setdefault(parent, []).append(hg)
+
+    num_nodes = len(haplogroups) + len(dangling)
+    codes: Dict[str, int] = {}
+    depth = np.zeros(num_nodes, dtype=np.int32)
+    parent_codes = np.full(num_nodes, -1, dtype=np.int64)
+
+    queue = deque(roots)
+    while queue:
+        hg = queue.popleft()
+        code = len(codes)
+        codes[hg] = code
+
+        parent = parent_map.get(hg)
+        if parent in codes:
+            parent_codes[code] = codes[parent]
+            depth[code] = depth[codes[parent]] + 1
+        else:
+            depth[code] = 1
+
+        queue.extend(children.get(hg, ()))
+
+    # Any haplogroup left uncoded sits on a parent cycle; treat it as a root.
+    for hg in tree_df.index:
+        if hg not in codes:
+            code = len(codes)
+            codes[hg] = code
+            depth[code] = 1
+
+    if len(codes) <= tree_index_max_bitmask_nodes:
+        num_words = (len(codes) + 63) // 64
+        ancestor_mask = np.zeros((len(codes), num_words), dtype=np.uint64)
+        for code in range(len(codes)):
+            parent_code = parent_codes[code]
+            if parent_code >= 0:
+                ancestor_mask[code] = ancestor_mask[parent_code]
+            ancestor_mask[code, code >> 6] |= np.uint64(1 << (code & 63))
+    else:
+        ancestor_mask = None
+
+    _tree_index = TreeIndex(codes, depth, ancestor_mask)
+    _tree_index_tree_id = id(tree_df)
+    return _tree_index
 
 
 def get_common_lineage(
     a_lineage: Sequence[str], b_lineage: Sequence[str]
 ) -> Sequence[str]:
-    return list(
-        hgs[0]
-        for hgs in takewhile(
-            lambda hgs: hgs[0] == hgs[1], zip(reversed(a_lineage), reversed(b_lineage))
-        )
-    )
+    # Compare the root-aligned lineages in one vectorized pass and take the
+    # common-prefix length, instead of pairwise takewhile iteration.
+    min_len = min(len(a_lineage), len(b_lineage))
+    if min_len == 0:
+        return []
 
+    a_from_root = np.asarray(a_lineage[::-1][:min_len], dtype=object)
+    b_from_root = np.asarray(b_lineage[::-1][:min_len], dtype=object)
+    equal = a_from_root == b_from_root
+    common_len = min_len if equal.all() else int(equal.argmin())
 
-def kit_matches_lineage(
+    return list(a_from_root[:common_len])
+
+
+def haplogroup_matches_lineage(
     tree_df: pd.DataFrame,
     a_lineage: Sequence[str],
-    b: pd.Series,
+    b_haplogroup: Optional[str],
     *,
     haplogroup: Optional[str],
     haplogroup_max_diff: Optional[int]
 ) -> bool:
-    b_lineage = get_haplogroup_lineage(tree_df, b["Haplogroup"])
+    b_lineage = get_haplogroup_lineage(tree_df, b_haplogroup)
     common_lineage = get_common_lineage(a_lineage, b_lineage)
     a_lineage_pos = len(a_lineage) - len(common_lineage)
     b_lineage_pos = len(b_lineage) - len(common_lineage)
@@ -113,3 +581,136 @@ def kit_matches_lineage(
     ):
         return False
     return True
+
+
+def kit_matches_lineage(
+    tree_df: pd.DataFrame,
+    a_lineage: Sequence[str],
+    b: pd.Series,
+    *,
+    haplogroup: Optional[str],
+    haplogroup_max_diff: Optional[int]
+) -> bool:
+    return haplogroup_matches_lineage(
+        tree_df,
+        a_lineage,
+        b["Haplogroup"],
+        haplogroup=haplogroup,
+        haplogroup_max_diff=haplogroup_max_diff,
+    )
+
+
+def _match_lineage_bitmask(
+    tree_df: pd.DataFrame,
+    index: TreeIndex,
+    a_lineage: Sequence[str],
+    haplogroups: Sequence[str],
+    *,
+    haplogroup: Optional[str],
+    haplogroup_max_diff: Optional[int]
+) -> Dict[str, bool]:
+    # The common-lineage length of two haplogroups is the size of the
+    # intersection of their ancestor sets, so with bit-masks both checks
+    # reduce to word-wise AND plus popcount and integer compares.
+    codes = index.codes
+    known = [hg for hg in haplogroups if hg in codes]
+    unknown = [hg for hg in haplogroups if hg not in codes]
+
+    matches = {
+        hg: haplogroup_matches_lineage(
+            tree_df,
+            a_lineage,
+            hg,
+            haplogroup=haplogroup,
+            haplogroup_max_diff=haplogroup_max_diff,
+        )
+        for hg in unknown
+    }
+    if not known:
+        return matches
+
+    assert index.ancestor_mask is not None
+    hg_ids = np.fromiter((codes[hg] for hg in known), dtype=np.int64)
+    masks = index.ancestor_mask[hg_ids]
+
+    ok = np.ones(len(known), dtype=bool)
+
+    if haplogroup is not None:
+        query_id = codes.get(haplogroup)
+        if query_id is None:
+            ok[:] = False
+        else:
+            ok &= (
+                masks[:, query_id >> 6] >> np.uint64(query_id & 63) & np.uint64(1)
+            ).astype(bool)
+
+    if haplogroup_max_diff is not None:
+        a_hg = first(a_lineage)
+        if a_hg is not None and a_hg in codes:
+            a_mask = index.ancestor_mask[codes[a_hg]]
+            common = (
+                _popcount_table[(masks & a_mask).view(np.uint8)]
+                .sum(axis=1)
+                .astype(np.int32)
+            )
+        else:
+            common = np.zeros(len(known), dtype=np.int32)
+
+        a_pos = np.int32(len(a_lineage)) - common
+        b_pos = index.depth[hg_ids] - common
+        ok &= np.abs(a_pos - b_pos) <= haplogroup_max_diff
+
+    matches.update(zip(known, ok.tolist()))
+    return matches
+
+
+def kits_match_lineage(
+    tree_df: pd.DataFrame,
+    a_lineage: Sequence[str],
+    haplogroups: pd.Series,
+    *,
+    haplogroup: Optional[str],
+    haplogroup_max_diff: Optional[int]
+) -> pd.Series:
+    # Evaluate the predicate once per distinct haplogroup rather than per kit;
+    # sibling kits overwhelmingly share haplogroups.
+    unique_hgs = haplogroups.dropna().unique()
+    index = get_tree_index(tree_df)
+    if index.ancestor_mask is not None:
+        matches = _match_lineage_bitmask(
+            tree_df,
+            index,
+            a_lineage,
+            unique_hgs,
+            haplogroup=haplogroup,
+            haplogroup_max_diff=haplogroup_max_diff,
+        )
+    else:
+        prime_lineage_cache(tree_df, unique_hgs)
+        matches = {
+            hg: haplogroup_matches_lineage(
+                tree_df,
+                a_lineage,
+                hg,
+                haplogroup=haplogroup,
+                haplogroup_max_diff=haplogroup_max_diff,
+            )
+            for hg in unique_hgs
+        }
+    na_matches = haplogroup_matches_lineage(
+        tree_df,
+        a_lineage,
+        None,
+        haplogroup=haplogroup,
+        haplogroup_max_diff=haplogroup_max_diff,
+    )
+
+    # Reduce the per-haplogroup results to an acceptable set and apply it
+    # with one hash-based isin pass, which also works directly on the
+    # categorical column (mapping it would need an object cast).
+    acceptable = [hg for hg, ok in matches.items() if ok]
+    mask = haplogroups.isin(acceptable)
+    if na_matches:
+        mask |= haplogroups.isna()
+
+    return mask
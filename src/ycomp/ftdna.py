@@ -1,66 +1,233 @@
+from __future__ import annotations
+
 import asyncio
+import atexit
+import hashlib
+import re
 import shelve
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import suppress
-from enum import Enum, auto
+from functools import lru_cache
+from pathlib import Path
 from typing import *
 
-import pandas as pd
-import pyppeteer
-import pyppeteer.errors
-from bs4 import NavigableString, Tag
-from mechanicalsoup import Form, StatefulBrowser
-from platformdirs import PlatformDirs
-from pyppeteer.element_handle import ElementHandle
-
 from .common import *
+from .pyppeteer_pool import PagePool
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from lxml.html import HtmlElement
+    from pyppeteer.browser import Browser
+    from pyppeteer.element_handle import ElementHandle
+    from requests.cookies import RequestsCookieJar
 
 
 Cookies = List[Dict[str, Union[str, int, bool]]]
 
 
-class DownloadFtdnaError(Exception, Enum):
-    NOT_FOUND = auto()
-    RESULTS_UNAVAILABLE = auto()
-    RESULTS_HIDDEN = auto()
-    UNKNOWN_PAGE_LAYOUT = auto()
-
-    def __str__(self) -> str:
-        if self == self.NOT_FOUND:
-            return "Group not found"
-        elif self == self.RESULTS_UNAVAILABLE:
-            return "Results page unavailable"
-        elif self == self.RESULTS_HIDDEN:
-            return "Results page hidden"
-        elif self == self.UNKNOWN_PAGE_LAYOUT:
-            return "Unknown page layout"
-        else:
-            raise ValueError(f"Invalid error kind")
+_no_results_xpath = '//div[@id = "MainContent_pnlNoYResults"]'
+_hidden_results_xpath = '//div[@id = "MainContent_pnlHiddenYResults"]'
+_form_xpath = '//form[@id = "form1"]'
+_gridview_xpath = (
+    '//div[contains(concat(" ", normalize-space(@class), " "), " AspNet-GridView ")]'
+)
+_table_xpath = ".//table"
+_page_size_xpath = '//input[contains(@id, "tbPageSize")]'
+_hidden_input_xpath = './/input[@type = "hidden"]'
+_pagination_xpath = (
+    '//div[contains(concat(" ", normalize-space(@class), " "),'
+    ' " AspNet-GridView-Pagination ")]'
+)
+
+_pagination_pattern = re.compile(r"(\d+)\s+of\s+(\d+)")
+
+_compiled_xpaths: Dict[str, Any] = {}
+
+
+def _xpath(expr: str) -> Any:
+    # Compile each XPath expression to its C form once per process; the
+    # fetch loop re-applies the same handful of expressions on every page.
+    compiled = _compiled_xpaths.get(expr)
+    if compiled is None:
+        from lxml import etree
+
+        compiled = _compiled_xpaths[expr] = etree.XPath(expr)
+
+    return compiled
 
 
+class DownloadFtdnaError(Exception):
+    NOT_FOUND: ClassVar[DownloadFtdnaError]
+    RESULTS_UNAVAILABLE: ClassVar[DownloadFtdnaError]
+    RESULTS_HIDDEN: ClassVar[DownloadFtdnaError]
+    UNKNOWN_PAGE_LAYOUT: ClassVar[DownloadFtdnaError]
+
+
+# Singleton instances constructed once at import, so raise sites skip the
+# enum metaclass machinery and stringification goes through the message.
+DownloadFtdnaError.NOT_FOUND = DownloadFtdnaError("Group not found")
+DownloadFtdnaError.RESULTS_UNAVAILABLE = DownloadFtdnaError("Results page unavailable")
+DownloadFtdnaError.RESULTS_HIDDEN = DownloadFtdnaError("Results page hidden")
+DownloadFtdnaError.UNKNOWN_PAGE_LAYOUT = DownloadFtdnaError("Unknown page layout")
+
+
+@lru_cache(maxsize=1)
 def open_ftdna_login_cache() -> shelve.Shelf:
-    return shelve.open(str(cache_dir() / "ftdna-login"))
+    # One dbm open per process: the shelf stays open across commands and is
+    # flushed and closed at interpreter exit.
+    shelf = shelve.open(str(cache_dir() / "ftdna-login"))
+    atexit.register(shelf.close)
+    return shelf
 
 
-def ftdna_normalize_columns(kits_df: pd.DataFrame) -> None:
-    if "Last Name" in kits_df.columns:
-        if "Paternal Ancestor Name" not in kits_df.columns:
-            kits_df.rename(
-                columns={"Last Name": "Paternal Ancestor Name"}, inplace=True
+def cookies_to_jar(cookies: Cookies) -> RequestsCookieJar:
+    """Convert browser cookie dicts to a cookie jar for `requests`.
+
+    Done once when the cookies are written to the login cache, so each fetch
+    unpickles a ready jar instead of rebuilding one cookie at a time.
+    """
+
+    from requests.cookies import RequestsCookieJar
+
+    jar = RequestsCookieJar()
+    for cookie in cookies:
+        jar.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie.get("domain", ""),
+            path=cookie.get("path", "/"),
+        )
+
+    return jar
+
+
+def _browser_endpoint_path() -> Path:
+    return cache_dir() / "ftdna-browser-ws"
+
+
+async def _connect_browser(*, http_timeout: float) -> Browser:
+    """Connect to the shared Chromium process, launching it on first use.
+
+    Launching Chromium dominates the wall time of the sign-in commands, so
+    the browser is left running across invocations; its DevTools websocket
+    endpoint is kept in the cache directory and later commands attach to it,
+    detaching with `disconnect` rather than closing it. `ftdna_browser_stop`
+    shuts it down.
+    """
+
+    import pyppeteer
+
+    endpoint_path = _browser_endpoint_path()
+    try:
+        endpoint = endpoint_path.read_text().strip()
+    except FileNotFoundError:
+        endpoint = None
+
+    if endpoint:
+        try:
+            return await asyncio.wait_for(
+                pyppeteer.connect(browserWSEndpoint=endpoint), http_timeout
             )
-        else:
+        except Exception:
+            # The browser from a previous run is gone; launch a fresh one.
+            endpoint_path.unlink(missing_ok=True)
+
+    browser = await pyppeteer.launch(
+        headless=True,
+        args=["--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu"],
+        timeout=http_timeout * 1000,
+        autoClose=False,
+        handleSIGINT=False,
+        handleSIGTERM=False,
+        handleSIGHUP=False,
+    )
+    endpoint_path.write_text(browser.wsEndpoint)
+
+    return browser
+
+
+async def _browser_page_pool(browser: Browser) -> PagePool:
+    pool = PagePool(browser)
+    await pool.adopt()
+    return pool
+
+
+def ftdna_browser_stop() -> None:
+    import pyppeteer
+
+    endpoint_path = _browser_endpoint_path()
+    try:
+        endpoint = endpoint_path.read_text().strip()
+    except FileNotFoundError:
+        endpoint = None
+
+    if not endpoint:
+        echo(f"No shared browser is running.")
+        return
+
+    async def run() -> None:
+        browser = await asyncio.wait_for(
+            pyppeteer.connect(browserWSEndpoint=endpoint), 10
+        )
+        await browser.close()
+
+    try:
+        asyncio.run(run())
+        echo(f"Stopped shared browser.")
+    except Exception:
+        secho(f"Shared browser was not running.", fg=colors.YELLOW, err=True)
+
+    endpoint_path.unlink(missing_ok=True)
+
+
+def ftdna_normalize_columns(kits_df: pd.DataFrame) -> None:
+    # Fold each alternate name column into the canonical one. `pop` removes
+    # the source column in a single dict operation and `combine_first` fills
+    # the gaps in one where-pass, instead of the fillna-then-drop pair that
+    # copied the column twice.
+    for col in ("Last Name", "Name"):
+        if col not in kits_df.columns:
+            continue
+
+        if "Paternal Ancestor Name" in kits_df.columns:
             kits_df["Paternal Ancestor Name"] = kits_df[
                 "Paternal Ancestor Name"
-            ].fillna(kits_df["Last Name"])
-            kits_df.drop("Last Name", axis=1, inplace=True)
+            ].combine_first(kits_df.pop(col))
+        else:
+            kits_df.rename(columns={col: "Paternal Ancestor Name"}, inplace=True)
+
+
+def table_to_df(table: HtmlElement) -> Optional[pd.DataFrame]:
+    """Extract an HTML table into a data frame by iterating the lxml tree,
+    so row and cell extraction run in C without a serialize-and-reparse
+    round trip through `pd.read_html`."""
+
+    import pandas as pd
 
-    if "Name" in kits_df.columns:
-        if "Paternal Ancestor Name" not in kits_df.columns:
-            kits_df.rename(columns={"Name": "Paternal Ancestor Name"}, inplace=True)
+    header: Optional[List[str]] = None
+    data: List[List[str]] = []
+    for row in table.iter("tr"):
+        # Collect cell text and the header check in one pass over the row's
+        # children, rather than materializing the cell list twice.
+        values: List[str] = []
+        all_header_cells = True
+        for cell in row.iterchildren("td", "th"):
+            values.append(cell.text_content().strip())
+            if cell.tag != "th":
+                all_header_cells = False
+
+        if not values:
+            continue
+
+        if header is None and all_header_cells:
+            header = values
         else:
-            kits_df["Paternal Ancestor Name"] = kits_df[
-                "Paternal Ancestor Name"
-            ].fillna(kits_df["Name"])
-            kits_df.drop("Name", axis=1, inplace=True)
+            data.append(values)
+
+    if header is None and not data:
+        return None
+
+    return pd.DataFrame(data, columns=header)
 
 
 def ftdna_fetch_kits(
@@ -69,110 +236,165 @@ def ftdna_fetch_kits(
     def id_to_form_input_name(id: str) -> str:
         return "ctl00$" + id.replace("_", "$")
 
-    kits_df: pd.DataFrame = None
+    def parse_table(table: HtmlElement, page: int) -> Optional[pd.DataFrame]:
+        page_df = table_to_df(table)
+
+        # Drop header row of table for all but first page.
+        if page_df is not None and page > 1:
+            page_df = page_df.iloc[1:]
+
+        return page_df
+
+    import lxml.html
+    import pandas as pd
+    import requests
+
+    page_futures: List[Future[Optional[pd.DataFrame]]] = []
 
     prelim: bool = True
     gridview_input_name: str
     page_size_input_name: str
-    page_df = None
-
-    browser = StatefulBrowser()
-
-    # Configure cookies for requests.
-    cookie_jar = browser.get_cookiejar()
-    with open_ftdna_login_cache() as shelf:
-        cookies = shelf.get("cookies", ())
-        for cookie in cookies:
-            cookie_jar.set(
-                cookie["name"],
-                cookie["value"],
-                domain=cookie.get("domain"),
-                path=cookie.get("path"),
-            )
+    prev_table_hash: Optional[bytes] = None
+    form_payload: Dict[str, Any] = {}
+
+    # A bare HTTP session suffices: the only form interaction is posting the
+    # ASP.NET event fields back, so the browser emulation layer (and its
+    # full-document soup parse per navigation) is unnecessary.
+    session = requests.Session()
+
+    # Keep the connection to FTDNA alive across the paginated posts so each
+    # page reuses the same TCP/TLS connection instead of handshaking anew.
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    # Configure cookies for requests, preferring the jar prebuilt at sign-in
+    # time; fall back to the cookie dicts for caches written before the jar
+    # was stored.
+    shelf = open_ftdna_login_cache()
+    cookie_jar: Optional[RequestsCookieJar] = shelf.get("cookie_jar")
+    if cookie_jar is not None:
+        session.cookies.update(cookie_jar)
+    else:
+        session.cookies.update(cookies_to_jar(shelf.get("cookies", ())))
 
     echo(f"Fetching kits from <{url}>...")
-    response = browser.open(url, timeout=http_timeout)
+    response = session.get(url, timeout=http_timeout, stream=True)
     if not response.ok or response.url == "https://www.familytreedna.com/":
         raise DownloadFtdnaError.NOT_FOUND
 
+    # One worker is enough: it parses page N while the main thread posts the
+    # request for page N + 1.
+    executor = ThreadPoolExecutor(max_workers=1)
+
     while True:
-        if browser.page.select_one("div#MainContent_pnlNoYResults") is not None:
+        # Parse the response once with lxml, feeding the body straight from
+        # the socket into the C parser rather than buffering it as a Python
+        # bytes object first; all page inspection and the ASP.NET form state
+        # for the next post come from that tree.
+        response.raw.decode_content = True
+        page_tree = lxml.html.parse(response.raw).getroot()
+
+        if _xpath(_no_results_xpath)(page_tree):
             raise DownloadFtdnaError.RESULTS_UNAVAILABLE
 
-        if browser.page.select_one("div#MainContent_pnlHiddenYResults") is not None:
+        if _xpath(_hidden_results_xpath)(page_tree):
             raise DownloadFtdnaError.RESULTS_HIDDEN
 
-        form: Form = browser.select_form("form#form1")
+        form = first(_xpath(_form_xpath)(page_tree))
         if form is None:
             raise DownloadFtdnaError.UNKNOWN_PAGE_LAYOUT
 
-        form_tag: Tag = form.form
+        if not form_payload:
+            # Current values of every successful form control (__VIEWSTATE,
+            # __EVENTVALIDATION, inputs, ...), as a no-button form submission
+            # would send them. Walked once; only the hidden state fields
+            # change between pages, so later responses refresh just those.
+            form_payload = dict(form.form_values())
+        else:
+            for hidden_input in _xpath(_hidden_input_xpath)(form):
+                name = hidden_input.get("name")
+                if name:
+                    form_payload[name] = hidden_input.get("value", "")
 
-        gridview_div: Tag = form_tag.select_one("div.AspNet-GridView")
+        gridview_div: Optional[HtmlElement] = first(
+            _xpath(_gridview_xpath)(page_tree)
+        )
         if gridview_div is None:
             raise DownloadFtdnaError.UNKNOWN_PAGE_LAYOUT
 
-        table = gridview_div.select_one("table")
+        table: Optional[HtmlElement] = first(_xpath(_table_xpath)(gridview_div))
         if table is None:
             raise DownloadFtdnaError.UNKNOWN_PAGE_LAYOUT
 
         if prelim:
-            page_size_input: Tag = form_tag.select_one("input[id *= 'tbPageSize']")
+            page_size_input: Optional[HtmlElement] = first(
+                _xpath(_page_size_xpath)(page_tree)
+            )
+            if page_size_input is None:
+                raise DownloadFtdnaError.UNKNOWN_PAGE_LAYOUT
             page_size_input_name = page_size_input.get("name")
 
             if page_size is None or int(page_size_input.get("value", 0)) == page_size:
                 prelim = False
             else:
                 # Submit request to update page size.
-                browser[page_size_input_name] = str(page_size)
                 echo(f"Updating page size to {page_size}...")
-                browser.form.choose_submit_none()
-                response = browser.submit_selected(
+                response = session.post(
+                    response.url,
                     data={
+                        **form_payload,
+                        page_size_input_name: str(page_size),
                         "__EVENTTARGET": page_size_input_name,
                         "__EVENTARGUMENT": "",
                     },
                     timeout=http_timeout,
+                    stream=True,
                 )
                 response.raise_for_status()
 
+                # Keep the new page size in the base payload, since the
+                # hidden-field refresh above does not touch visible inputs.
+                form_payload[page_size_input_name] = str(page_size)
+
                 continue
 
-        # Extract current and maximum page numbers.
+        # Extract current and maximum page numbers, matching the "N of M"
+        # text in one regex pass rather than iterating child nodes.
         page = 1
         max_page = 1
-        pagination_div: Tag = form_tag.select_one("div.AspNet-GridView-Pagination")
-        if pagination_div:
-            for child in pagination_div.children:
-                if isinstance(child, Tag):
-                    if child.name.casefold() == "span":
-                        page = int(child.text.strip())
-                elif isinstance(child, NavigableString):
-                    of_prefix = " of "
-                    if child.text.startswith(of_prefix):
-                        max_page = int(child.removeprefix(of_prefix).strip())
+        pagination_div: Optional[HtmlElement] = first(
+            _xpath(_pagination_xpath)(page_tree)
+        )
+        if pagination_div is not None:
+            match = _pagination_pattern.search(pagination_div.text_content())
+            if match is not None:
+                page = int(match[1])
+                max_page = int(match[2])
 
         gridview_input_name = id_to_form_input_name(gridview_div.get("id"))
 
         echo(f"Processing page {page} of {max_page}...")
 
-        prev_page_df = page_df
-        page_df = first(pd.read_html(str(table)))
-        if page_df is None:
-            raise DownloadFtdnaError.UNKNOWN_PAGE_LAYOUT
+        # On a known final page there is nothing left to re-fetch, so skip
+        # the same-as-last digest check and stop right after parsing.
+        if page == max_page and max_page > 1:
+            page_futures.append(executor.submit(parse_table, table, page))
+            break
 
-        # Check if data frame is same as last.
-        if prev_page_df is not None and page_df.equals(prev_page_df):
+        # Check if page is same as last, comparing digests of the table HTML
+        # rather than frame contents; blake2 runs at memory bandwidth in C.
+        table_hash = hashlib.blake2b(
+            lxml.html.tostring(table), digest_size=16
+        ).digest()
+        if table_hash == prev_table_hash:
             break
+        prev_table_hash = table_hash
 
-        # Drop header row of table for all but first page.
-        if page > 1:
-            page_df.drop(page_df.index[0], inplace=True)
-
-        if kits_df is None:
-            kits_df = page_df
-        else:
-            kits_df = pd.concat([kits_df, page_df], axis=0)
+        # Parse the table on the worker thread, overlapping the next page's
+        # HTTP round trip, and concatenate the pages once at the end rather
+        # than re-copying the growing frame on every page.
+        page_futures.append(executor.submit(parse_table, table, page))
 
         # Check if there are any more pages remaining to fetch.
         if page == max_page:
@@ -181,19 +403,27 @@ def ftdna_fetch_kits(
         # Submit request for next page.
         next_page = page + 1
         echo(f"Fetching page {next_page}...")
-        browser.form.choose_submit_none()
-        response = browser.submit_selected(
+        response = session.post(
+            response.url,
             data={
+                **form_payload,
                 "__EVENTTARGET": gridview_input_name,
                 "__EVENTARGUMENT": f"Page${next_page}",
             },
             timeout=http_timeout,
+            stream=True,
         )
         response.raise_for_status()
 
+    page_dfs = [future.result() for future in page_futures]
+    executor.shutdown()
+
+    if any(page_df is None for page_df in page_dfs):
+        raise DownloadFtdnaError.UNKNOWN_PAGE_LAYOUT
+
     echo(f"Finished fetching kits.")
 
-    return kits_df
+    return pd.concat(page_dfs, axis=0, ignore_index=True, copy=False)
 
 
 def ftdna_refresh(
@@ -204,9 +434,10 @@ def ftdna_refresh(
     ftdna_refresh_url = "https://www.familytreedna.com"
 
     async def run() -> None:
-        browser = await pyppeteer.launch(headless=True, timeout=http_timeout * 1000)
+        browser = await _connect_browser(http_timeout=http_timeout)
+        pool = await _browser_page_pool(browser)
 
-        page = await browser.newPage()
+        page = await pool.get_page()
 
         if cookies is not None:
             await page.setCookie(*cookies)
@@ -218,11 +449,12 @@ def ftdna_refresh(
         else:
             new_cookies = None
 
-        await browser.close()
+        await pool.release_page(page)
+        await browser.disconnect()
 
         return new_cookies
 
-    new_cookies = asyncio.get_event_loop().run_until_complete(run())
+    new_cookies = asyncio.run(run())
 
     if new_cookies:
         echo(f"Successfully refreshed FTDNA session.")
@@ -240,9 +472,10 @@ def ftdna_signin(
     ftdna_signin_url = "https://www.familytreedna.com/sign-in"
 
     async def run() -> Optional[Cookies]:
-        browser = await pyppeteer.launch(headless=True, timeout=http_timeout * 1000)
+        browser = await _connect_browser(http_timeout=http_timeout)
+        pool = await _browser_page_pool(browser)
 
-        page = await browser.newPage()
+        page = await pool.get_page()
         await page.goto(ftdna_signin_url)
         userInfoForm: ElementHandle = await page.waitForSelector(
             "form[name = userInfoForm]"
@@ -288,11 +521,12 @@ def ftdna_signin(
         else:
             cookies = None
 
-        await browser.close()
+        await pool.release_page(page)
+        await browser.disconnect()
 
         return cookies
 
-    cookies = asyncio.get_event_loop().run_until_complete(run())
+    cookies = asyncio.run(run())
 
     if cookies:
         echo(f"Successfully signed in to FTDNA.")
@@ -308,17 +542,19 @@ def ftdna_signout(cookies: Optional[Cookies], *, http_timeout: float) -> None:
     ftdna_signout_url = "https://www.familytreedna.com/sign-out"
 
     async def run() -> None:
-        browser = await pyppeteer.launch(headless=True, timeout=http_timeout * 1000)
+        browser = await _connect_browser(http_timeout=http_timeout)
+        pool = await _browser_page_pool(browser)
 
-        page = await browser.newPage()
+        page = await pool.get_page()
 
         if cookies is not None:
             await page.setCookie(*cookies)
 
         await page.goto(ftdna_signout_url, waitUntil="networkidle0")
 
-        await browser.close()
+        await pool.release_page(page)
+        await browser.disconnect()
 
-    asyncio.get_event_loop().run_until_complete(run())
+    asyncio.run(run())
 
     echo(f"Successfully signed out from FTDNA.")
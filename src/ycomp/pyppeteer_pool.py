@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import asyncio
+from typing import *
+
+if TYPE_CHECKING:
+    from pyppeteer.browser import Browser
+    from pyppeteer.page import Page
+
+
+class PagePool:
+    """Fixed-size pool of pre-warmed pages in a shared browser.
+
+    Pages are handed out from a queue and reset to `about:blank` on release
+    instead of being closed, so repeated operations skip the page startup
+    cost. `adopt` picks up blank pages already open in the browser, which
+    lets pooled pages survive across CLI invocations attached to the same
+    browser process.
+    """
+
+    def __init__(self, browser: Browser, size: int = 4):
+        self.browser = browser
+        self._size = size
+        self._num_pages = 0
+        self._idle_pages: asyncio.Queue[Page] = asyncio.Queue()
+
+    async def adopt(self) -> None:
+        for page in await self.browser.pages():
+            if self._num_pages >= self._size:
+                break
+
+            if page.url in ("", "about:blank"):
+                self._num_pages += 1
+                self._idle_pages.put_nowait(page)
+
+    async def get_page(self) -> Page:
+        if self._idle_pages.empty() and self._num_pages < self._size:
+            self._num_pages += 1
+            return await self.browser.newPage()
+
+        return await self._idle_pages.get()
+
+    async def release_page(self, page: Page) -> None:
+        await page.goto("about:blank")
+        self._idle_pages.put_nowait(page)
+
+    async def close(self) -> None:
+        while not self._idle_pages.empty():
+            page = self._idle_pages.get_nowait()
+            self._num_pages -= 1
+            await page.close()
@@ -1,5 +1,6 @@
 import re
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 from os import PathLike
 from pathlib import Path
@@ -18,6 +19,8 @@ app = Typer()
 
 ftdna_url_template = "https://www.familytreedna.com/public/{0}?iframe=ysnp"
 
+yfull_snp_file_pattern = re.compile(r"SNP_for_(YF\d+)_(\d+)")
+
 
 def get_relevant_snps(tree_df: pd.DataFrame, max_age=int) -> Set[str]:
     filtered_df = tree_df[tree_df["TMRCA (ybp)"] <= max_age]
@@ -40,76 +43,61 @@ def get_yfull_df(
         data, sep=";", index_col=0, header=None, names=[0, 1, 2, 3, 4]
     )
     info_df: pd.DataFrame = df.iloc[:3, :1]
-    snps_df: pd.DataFrame = df.iloc[3:]
+    snps_df: pd.DataFrame = df.iloc[3:].copy()
 
     haplogroup = cast(str, info_df.loc["Haplogroup", 1])
     terminal_snps = cast(str, info_df.loc["Terminal SNPs", 1]).split(" | ")
 
-    def fix_cols(read_count: Any, rating: Any) -> Tuple[Any, Any]:
-        if isinstance(read_count, str) and cast(str, read_count).startswith("*"):
-            rating = read_count
-            read_count = np.nan
-        return read_count, rating
-
-    fixed_cols_df = pd.DataFrame(
-        (
-            fix_cols(read_count, rating)
-            for read_count, rating in zip(snps_df[2], snps_df[3])
-        ),
-        index=snps_df.index,
-        columns=[2, 3],
+    # read_csv infers an all-empty column as float64 NaNs; cast the
+    # read-count and rating columns to string dtype so the .str kernels
+    # below see NA values instead of rejecting the accessor outright.
+    snps_df[[2, 3]] = snps_df[[2, 3]].astype("string")
+
+    # A rating in the read-count column means the read count is absent and
+    # the columns are shifted; fix the affected rows in one masked move.
+    swap_mask = snps_df[2].str.startswith("*", na=False)
+    if swap_mask.any():
+        snps_df.loc[swap_mask, 3] = snps_df.loc[swap_mask, 2]
+        snps_df.loc[swap_mask, 2] = np.nan
+
+    # Convert the columns with vectorized string kernels rather than
+    # per-element `apply`, validating each column in a single pass.
+    calls = snps_df[1]
+    known_calls = calls.isin(
+        ("no call", "ambiguous", "positive", "negative", "false positive", "false negative")
     )
-    snps_df = pd.concat([snps_df.loc[:, :1], fixed_cols_df], axis=1)
-
-    def call_to_bool(call: Any) -> Any:
-        if pd.isna(call):
-            return np.nan
-
-        if call == "no call":
-            return np.nan
-        elif call == "ambiguous":
-            return np.nan
-        elif call == "positive":
-            return True
-        elif call == "negative":
-            return False
-        elif call == "false positive":
-            return np.nan
-        elif call == "false negative":
-            return np.nan
-        else:
-            raise ValueError(f"Invalid SNP call '{call}'.")
-
-    def read_count_to_int(read_count: Any) -> Any:
-        if pd.isna(read_count):
-            return np.nan
-
-        count, _, read_str = cast(str, read_count).partition(" ")
-        if read_str == "read":
-            return int(count)
-        else:
-            raise ValueError(f"Invalid SNP read count '{read_count}'.")
-
-    def rating_to_int(rating: Any) -> Any:
-        if pd.isna(rating):
-            raise ValueError(f"Invalid SNP rating '{rating}'.")
-
-        rating_s: str = cast(str, rating)
-        if rating_s.strip("*") != "":
-            raise ValueError(f"Invalid SNP rating '{rating_s}'.")
-
-        return len(rating)
-
-    snps_df[1] = snps_df[1].apply(call_to_bool).astype("boolean")
-    snps_df[2] = snps_df[2].apply(read_count_to_int).astype("Int32")
-    snps_df[3] = snps_df[3].apply(rating_to_int).astype("int8")
-
-    new_rows: list[pd.Series] = []
-    for multi_snp, row in snps_df.iterrows():
-        for snp in (snp.strip() for snp in cast(str, multi_snp).split("/")):
-            new_rows.append(row.to_frame(snp).T)
+    invalid_calls = calls.notna() & ~known_calls
+    if invalid_calls.any():
+        raise ValueError(f"Invalid SNP call '{calls[invalid_calls].iloc[0]}'.")
+
+    read_counts = snps_df[2]
+    counts = read_counts.str.extract(r"^(\d+) read$", expand=False)
+    invalid_counts = read_counts.notna() & counts.isna()
+    if invalid_counts.any():
+        raise ValueError(
+            f"Invalid SNP read count '{read_counts[invalid_counts].iloc[0]}'."
+        )
 
-    snps_df = pd.concat(new_rows, axis=0)
+    ratings = snps_df[3]
+    invalid_ratings = ratings.isna() | (ratings.str.strip("*") != "")
+    if invalid_ratings.any():
+        raise ValueError(f"Invalid SNP rating '{ratings[invalid_ratings].iloc[0]}'.")
+
+    # Unmapped calls ("no call", "ambiguous", "false positive", ...) become
+    # NA automatically.
+    snps_df[1] = calls.map({"positive": True, "negative": False}).astype("boolean")
+    snps_df[2] = pd.to_numeric(counts).astype("Int32")
+    snps_df[3] = ratings.str.len().astype("int8")
+
+    # Expand multi-SNP rows ("L23/L24") in one shot: repeat each row once
+    # per name with a single take and flatten the split names directly into
+    # the new index, sized up front instead of growing through concat.
+    snp_lists = snps_df.index.str.split("/")
+    counts = np.fromiter(
+        (len(snps) for snps in snp_lists), dtype=np.intp, count=len(snp_lists)
+    )
+    snps_df = snps_df.iloc[np.repeat(np.arange(len(snps_df)), counts)]
+    snps_df.index = pd.Index([snp.strip() for snps in snp_lists for snp in snps])
 
     snps_df.rename(
         {
@@ -147,7 +135,7 @@ def add_yfull(
     """Add a YFull kit to the Kits SNP database."""
 
     if kit is None:
-        match = re.fullmatch(r"SNP_for_(YF\d+)_(\d+)", file.stem)
+        match = yfull_snp_file_pattern.fullmatch(file.stem)
         if not match:
             raise BadParameter(
                 "Could not infer kit name from filename; specify it explicitly.",
@@ -242,8 +230,11 @@ def remove(
 
 @app.command()
 def fetch_ftdna(
-    ftdna_group: str = Option(
-        ..., "--group", "-g", help="The name of the FTDNA group to fetch kits from."
+    ftdna_groups: List[str] = Option(
+        ...,
+        "--group",
+        "-g",
+        help="The name of an FTDNA group to fetch kits from. May be given multiple times.",
     ),
     page_size: int = Option(
         250, "--page-size", "-p", help="The page size to use when fetching kits."
@@ -251,11 +242,21 @@ def fetch_ftdna(
 ) -> None:
     """Fetch kit SNP data from FTDNA and store it in the database."""
 
+    urls = [
+        ftdna_url_template.format(urllib.parse.quote(ftdna_group))
+        for ftdna_group in ftdna_groups
+    ]
+
     try:
-        url = ftdna_url_template.format(urllib.parse.quote(ftdna_group))
-        kits_df = ftdna_fetch_kits(
-            url, page_size=page_size, http_timeout=15 + 0.2 * page_size
-        )
+        with ThreadPoolExecutor(max_workers=min(4, len(urls))) as executor:
+            group_dfs = list(
+                executor.map(
+                    lambda url: ftdna_fetch_kits(
+                        url, page_size=page_size, http_timeout=15 + 0.2 * page_size
+                    ),
+                    urls,
+                )
+            )
     except DownloadFtdnaError as e:
         if debug_mode():
             raise
@@ -263,11 +264,13 @@ def fetch_ftdna(
         secho(f"ERROR: {e}", fg=colors.RED, err=True)
         raise Exit(1)
 
+    kits_df = pd.concat(group_dfs, axis=0, ignore_index=True, copy=False)
+
     echo(f"Processing kits from FTDNA...")
 
     # Clean data.
     kits_df.rename(columns={"Short Hand": "Haplogroup"}, inplace=True)
-    kits_df["Haplogroup"].replace(["-"], None, inplace=True)
+    kits_df["Haplogroup"] = kits_df["Haplogroup"].replace(["-"], None)
 
     ftdna_normalize_columns(kits_df)
 
@@ -283,36 +286,34 @@ def fetch_ftdna(
         )
     kits_df["Haplogroup"] = kits_df["Haplogroup"].astype("string")
 
-    def expand_row(row: Any) -> pd.Series:
-        def get_snp_value(call: str) -> Optional[Tuple[str, bool]]:
-            value: bool
-            if call[-1] == "+":
-                # Positive call
-                value = True
-            elif call[-1] == "-":
-                # Negative call
-                value = False
-            elif call[-1] == "*":
-                # No/ambiguous call
-                return None
-            else:
-                raise ValueError(f"Invalid SNP call '{call}'.")
-
-            return call[:-1], value
-
-        cols = (
-            dict(
-                filter(
-                    None, (get_snp_value(call) for call in cast(str, row).split(", "))
-                )
-            )
-            if pd.notna(row)
-            else None
+    # Expand out columns for SNPs: explode every call into long form, read
+    # the trailing +/-/* with vectorized string kernels, and pivot back to
+    # wide boolean columns, instead of building a dict and Series per kit.
+    calls = kits_df["Confirmed SNPs"].dropna().str.split(", ").explode()
+    signs = calls.str[-1]
+    invalid_calls = ~signs.isin(("+", "-", "*"))
+    if invalid_calls.any():
+        raise ValueError(f"Invalid SNP call '{calls[invalid_calls].iloc[0]}'.")
+
+    # Drop no/ambiguous calls ("*"); "+" is positive, "-" negative.
+    called = (signs != "*").to_numpy()
+    long_df = pd.DataFrame(
+        {
+            "Kit Number": calls.index.to_numpy()[called],
+            "SNP": calls.str[:-1].to_numpy()[called],
+            "Value": (signs == "+").to_numpy()[called],
+        }
+    )
+    expanded_rows = (
+        long_df.pivot_table(
+            # Contradictory duplicate calls within a kit resolve to the last
+            # occurrence, as the per-kit dicts did before.
+            index="Kit Number", columns="SNP", values="Value", aggfunc="last"
         )
-        return pd.Series(cols, dtype="boolean")
-
-    # Expand out columns for SNPs.
-    expanded_rows = kits_df["Confirmed SNPs"].apply(expand_row)
+        .astype("boolean")
+        .reindex(kits_df.index)
+        .rename_axis(None, axis=1)
+    )
 
     kits_df = pd.concat(
         [
@@ -344,7 +345,10 @@ def merge_str_db() -> None:
 
     echo(f"Found {len(kits_snp_df):,} kits in Kits SNP database.")
 
-    kits_str_df = load_db(str_cmd.kits_str_path)
+    kits_str_df = load_db(
+        str_cmd.kits_str_path,
+        columns=["Group", "Paternal Ancestor Name", "Country", "Haplogroup"],
+    )
     if kits_str_df is None:
         secho(f"ERROR: Kits STR database does not exist.", fg=colors.RED, err=True)
         raise Exit(1)
@@ -356,6 +360,9 @@ def merge_str_db() -> None:
     str_data_df = kits_str_df[
         ["Group", "Paternal Ancestor Name", "Country", "Haplogroup"]
     ]
+    # The STR database may contain haplogroups outside the SNP column's
+    # categories, so update via a plain string column.
+    kits_snp_df["Haplogroup"] = kits_snp_df["Haplogroup"].astype("string")
     kits_snp_df.update(str_data_df)
 
     echo("Finished merging.")
@@ -395,14 +402,14 @@ def analyze(
 
     echo(f"Found {len(kits_df):,} kits in Kits SNP database.")
 
-    snps_df = load_db(snps_path)
+    snps_df = load_db(snps_path, columns=["Standard Name"])
     if snps_df is None:
         secho(f"WARNING: SNPs database does not exist.", fg=colors.YELLOW, err=True)
 
     if snps_df is not None:
         echo(f"Found {len(snps_df):,} entries in SNPs database.")
 
-    tree_df = load_db(tree_path)
+    tree_df = load_tree_db()
     if tree_df is None:
         secho(f"WARNING: Tree database does not exist.", fg=colors.YELLOW, err=True)
 
@@ -410,15 +417,12 @@ def analyze(
     self_kit_lineage = get_haplogroup_lineage(tree_df, self_kit_hg)
 
     kits_df = kits_df[
-        kits_df.apply(
-            lambda kit: kit_matches_lineage(
-                tree_df,
-                self_kit_lineage,
-                kit,
-                haplogroup=haplogroup,
-                haplogroup_max_diff=haplogroup_max_diff,
-            ),
-            axis=1,
+        kits_match_lineage(
+            tree_df,
+            self_kit_lineage,
+            kits_df["Haplogroup"],
+            haplogroup=haplogroup,
+            haplogroup_max_diff=haplogroup_max_diff,
         )
     ]
     echo(f"Will compare {len(kits_df.index):,} kits.")
@@ -436,23 +440,34 @@ def analyze(
     kits_snps_df.drop(irrelevant_snps & set(kits_snps_df.columns), axis=1, inplace=True)
 
     if snps_df is not None:
-        # Merge columns for equivalent SNPs.
-        new_cols: OrderedDict[str, str] = OrderedDict()
-
-        def get_standard_snp_name(snp: str) -> str:
-            try:
-                return snps_df.loc[snp, "Standard Name"]
-            except KeyError:
-                return snp
-
-        for col in kits_snps_df.columns:
-            new_col = get_standard_snp_name(col)
-            if new_col in new_cols:
-                new_cols[new_col] = float_or(new_cols[new_col], kits_snps_df[col])
-            else:
-                new_cols[new_col] = kits_snps_df[col]
+        # Merge columns for equivalent SNPs under their standard names,
+        # materializing the name mapping as a plain dict once so the column
+        # mapping is straight hash lookups without index alignment.
+        std_names = snps_df.loc[~snps_df.index.duplicated(), "Standard Name"].to_dict()
+        name_map = kits_snps_df.columns.to_series().map(std_names)
+        name_map = name_map.where(name_map.notna(), kits_snps_df.columns)
+
+        # float_or on the {0, 1, NaN} domain is a NaN-filling maximum, so
+        # multi-column groups reduce to one groupwise max over the whole
+        # matrix instead of a per-column float_or/concat loop; single-column
+        # groups pass through unchanged, keeping their NaNs, as before.
+        multi = (name_map.map(name_map.value_counts()) > 1).to_numpy()
+        if multi.any():
+            merged_df = (
+                kits_snps_df.loc[:, multi]
+                .fillna(0)
+                .groupby(name_map[multi].to_numpy(), axis=1, sort=False)
+                .max()
+            )
+            single_df = kits_snps_df.loc[:, ~multi].set_axis(
+                name_map[~multi].to_numpy(), axis=1
+            )
+            kits_snps_df = pd.concat([single_df, merged_df], axis=1)
 
-        kits_snps_df = pd.concat(new_cols, axis=1)
+            # Restore first-seen column order.
+            kits_snps_df = kits_snps_df.loc[:, pd.unique(name_map.to_numpy())]
+        else:
+            kits_snps_df = kits_snps_df.set_axis(name_map.to_numpy(), axis=1)
 
     echo(f"Will compare {len(kits_snps_df.columns):,} SNPs.")
 
@@ -466,33 +481,55 @@ def analyze(
 
     echo(f"Starting analysis...")
 
-    def get_snp_list(kit_s: pd.Series) -> str:
-        return ", ".join(kit_s[kit_s == 1].index)
-
-    self_kit_isna_s = float_isna(self_kit_s)
-
-    def get_shared_snps(kit_s: pd.Series) -> pd.Series:
-        return float_and(self_kit_s, kit_s)
-
-    def get_assumed_shared_snps(kit_s: pd.Series) -> pd.Series:
-        return float_or(
-            float_and(self_kit_s, float_isna(kit_s)), float_and(self_kit_isna_s, kit_s)
+    snp_names = kits_snps_df.columns.to_numpy()
+    kit_index = kits_snps_df.index
+
+    # Encode the matrix as trinary int8 with -1 for missing: half the memory
+    # traffic of float16 over the wide kits x SNPs block, with the broadcast
+    # compares and row reductions below running on SIMD integer paths.
+    matrix = kits_snps_df.fillna(-1).to_numpy(dtype="int8")
+    self_row = self_kit_s.fillna(-1).to_numpy(dtype="int8")
+
+    def get_snp_lists(mask: np.ndarray) -> pd.Series:
+        if mask.shape[0] == 0:
+            return pd.Series(index=kit_index, dtype="object")
+
+        # One nonzero sweep over the whole mask, bucketed into rows by
+        # searchsorted, with a single string join per output row.
+        rows, cols = np.nonzero(mask)
+        split_at = np.searchsorted(rows, np.arange(1, mask.shape[0]))
+        return pd.Series(
+            [", ".join(snp_names[c]) for c in np.split(cols, split_at)],
+            index=kit_index,
         )
 
-    shared_snps = kits_snps_df.apply(lambda s: get_shared_snps(s), axis=1)
-    list_shared_snps = shared_snps.apply(get_snp_list, axis=1)
-    num_shared_snps = shared_snps.sum(axis=1)
-    num_comp_shared_snps = shared_snps.count(axis=1)
+    def count_rows(mask: np.ndarray) -> pd.Series:
+        return pd.Series(np.count_nonzero(mask, axis=1), index=kit_index)
+
+    # Elementary masks computed once; every kernel below derives from these
+    # instead of re-scanning the matrix.
+    matrix_pos = matrix == 1
+    matrix_missing = matrix == -1
+    self_pos = self_row == 1
+    self_missing = self_row == -1
+
+    shared_mask = matrix_pos & self_pos
+    compared_mask = ~matrix_missing & ~self_missing
+    list_shared_snps = get_snp_lists(shared_mask)
+    num_shared_snps = count_rows(shared_mask)
+    num_comp_shared_snps = count_rows(compared_mask)
     frac_shared_snps = num_shared_snps / num_comp_shared_snps
 
-    assum_shared_snps = kits_snps_df.apply(lambda s: get_assumed_shared_snps(s), axis=1)
-    list_assum_shared_snps = assum_shared_snps.apply(get_snp_list, axis=1)
-    num_assum_shared_snps = assum_shared_snps.sum(axis=1)
-    num_comp_assum_shared_snps = assum_shared_snps.count(axis=1)
+    # Assumed shared: one side missing while the other is positive. As with
+    # the NaN-filling float_or before, every SNP counts as compared here.
+    assum_mask = (matrix_missing & self_pos) | (matrix_pos & self_missing)
+    list_assum_shared_snps = get_snp_lists(assum_mask)
+    num_assum_shared_snps = count_rows(assum_mask)
+    num_comp_assum_shared_snps = pd.Series(matrix.shape[1], index=kit_index)
     frac_assum_shared_snps = num_assum_shared_snps / num_comp_assum_shared_snps
 
-    shared_snps = float_or(shared_snps, assum_shared_snps)
-    list_all_shared_snps = shared_snps.apply(get_snp_list, axis=1)
+    all_shared_mask = shared_mask | assum_mask
+    list_all_shared_snps = get_snp_lists(all_shared_mask)
     num_all_shared_snps = num_shared_snps + num_assum_shared_snps
     num_comp_all_shared_snps = num_comp_shared_snps + num_comp_assum_shared_snps
     frac_all_shared_snps = num_all_shared_snps / num_comp_all_shared_snps
@@ -537,5 +574,8 @@ def analyze(
 
     echo(f"Finished analysis.")
 
-    results_df.sort_values("All Shared SNPs (#)", ascending=False).to_csv(output_file)
+    # Reorder through argsort + iloc and stream the CSV in chunks, avoiding
+    # a second full copy of the frame at serialization time.
+    order = np.argsort(-results_df["All Shared SNPs (#)"].to_numpy(), kind="stable")
+    results_df.iloc[order].to_csv(output_file, chunksize=50_000)
     echo(f"Analysis written to `{output_file}`.")
@@ -1,12 +1,14 @@
 import re
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import lru_cache
 from os import PathLike
 from pathlib import Path
 from typing import *
 
 import numpy as np
 import pandas as pd
-from more_itertools import distinct_combinations, flatten
 from typer_cloup import *
 
 from .common import *
@@ -18,6 +20,8 @@ app = Typer()
 
 ftdna_url_template = "https://www.familytreedna.com/public/{0}?iframe=yresults"
 
+yfull_str_file_pattern = re.compile(r"STR_for_(YF\d+)_(\d+)")
+
 
 def get_yfull_df(data: Union[IO, PathLike]) -> pd.DataFrame:
     df: pd.DataFrame = pd.read_csv(data, sep=";", index_col=0, header=None)
@@ -79,7 +83,7 @@ def add_yfull(
     """Add a YFull kit to the Kits STR database."""
 
     if kit is None:
-        match = re.fullmatch(r"STR_for_(YF\d+)_(\d+)", file.stem)
+        match = yfull_str_file_pattern.fullmatch(file.stem)
         if not match:
             raise BadParameter(
                 "Could not infer kit name from filename; specify it explicitly.",
@@ -101,26 +105,21 @@ def add_yfull(
 
     yfull_series = yfull_df["Repeats"]
 
-    # Join together multi-copy loci values.
-    new_vals: OrderedDict[str, Optional[list]] = OrderedDict()
-    for index in yfull_series.index:
-        value = yfull_series[index]
-        locus, _, num = index.partition(".")
-
-        if pd.isna(value):
-            new_vals[locus] = None
-            continue
-
-        if num and locus in new_vals:
-            new_col = cast(list, new_vals[locus])
-            new_col.append(value)
-            new_vals[locus] = new_col
-        else:
-            new_vals[locus] = [value]
-
-    yfull_series = pd.Series(new_vals).apply(
-        lambda lst: [int(x) for x in lst] if isinstance(lst, list) else None
+    # Join together multi-copy loci values by grouping on the locus stem,
+    # instead of looping over the index entries in Python. A locus with a
+    # missing copy is stored as None, as before.
+    locus_stems = yfull_series.index.to_series().str.partition(".")[0]
+    has_value = yfull_series.notna()
+    grouped = (
+        yfull_series[has_value]
+        .groupby(locus_stems[has_value].to_numpy(), sort=False)
+        .apply(lambda values: [int(value) for value in values])
     )
+
+    locus_order = pd.unique(locus_stems.to_numpy())
+    na_loci = locus_stems[~has_value].unique()
+    yfull_series = grouped.reindex(locus_order).astype("object")
+    yfull_series[yfull_series.isna() | yfull_series.index.isin(na_loci)] = None
     yfull_df = yfull_series.to_frame(kit).T
     yfull_df.rename_axis("Kit Number", axis=0, inplace=True)
 
@@ -195,8 +194,11 @@ def remove(
 
 @app.command()
 def fetch_ftdna(
-    ftdna_group: str = Option(
-        ..., "--group", "-g", help="The name of the FTDNA group to fetch kits from."
+    ftdna_groups: List[str] = Option(
+        ...,
+        "--group",
+        "-g",
+        help="The name of an FTDNA group to fetch kits from. May be given multiple times.",
     ),
     page_size: int = Option(
         500, "--page-size", "-p", help="The page size to use when fetching kits."
@@ -204,11 +206,21 @@ def fetch_ftdna(
 ) -> None:
     """Fetch kit STR data from FTDNA and store it in the database."""
 
+    urls = [
+        ftdna_url_template.format(urllib.parse.quote(ftdna_group))
+        for ftdna_group in ftdna_groups
+    ]
+
     try:
-        url = ftdna_url_template.format(urllib.parse.quote(ftdna_group))
-        kits_df = ftdna_fetch_kits(
-            url, page_size=page_size, http_timeout=15 + 0.05 * page_size
-        )
+        with ThreadPoolExecutor(max_workers=min(4, len(urls))) as executor:
+            group_dfs = list(
+                executor.map(
+                    lambda url: ftdna_fetch_kits(
+                        url, page_size=page_size, http_timeout=15 + 0.05 * page_size
+                    ),
+                    urls,
+                )
+            )
     except DownloadFtdnaError as e:
         if debug_mode():
             raise
@@ -216,10 +228,12 @@ def fetch_ftdna(
         secho(f"ERROR: {e}", fg=colors.RED, err=True)
         raise Exit(1)
 
+    kits_df = pd.concat(group_dfs, axis=0, ignore_index=True, copy=False)
+
     echo(f"Processing kits from FTDNA...")
 
     # Clean data.
-    kits_df["Haplogroup"].replace(["-"], None, inplace=True)
+    kits_df["Haplogroup"] = kits_df["Haplogroup"].replace(["-"], None)
 
     ftdna_normalize_columns(kits_df)
 
@@ -236,31 +250,32 @@ def fetch_ftdna(
     kits_df["Country"] = kits_df["Country"].astype("string")
     kits_df["Haplogroup"] = kits_df["Haplogroup"].astype("string")
 
-    group = None
-
-    def get_group(kit_s: pd.Series) -> pd.Series:
-        nonlocal group
-
-        if kit_s[0] == kit_s[-1]:
-            group = kit_s[0]
-            return None
-        else:
-            return group
-
-    # Add group column and assign each kit to corresponding group.
-    group_series = kits_df.apply(get_group, axis=1)
+    # Group header rows repeat the group name in the first and last columns;
+    # detect them with one vectorized comparison and forward-fill the group
+    # name onto the kit rows below each header. Header rows themselves keep
+    # no group, so the drop below removes them as before.
+    first_col = kits_df.iloc[:, 0]
+    marker_rows = (first_col == kits_df.iloc[:, -1]).to_numpy()
+    group_series = first_col.where(marker_rows).ffill().mask(marker_rows)
     kits_df.insert(0, "Group", group_series)
     kits_df.drop(kits_df[kits_df["Group"].isna()].index, inplace=True)
 
-    # Parse multi-copy-loci columns.
+    # Parse multi-copy-loci columns by exploding each column once and
+    # re-aggregating the values per kit in C, rather than running a Python
+    # list comprehension per cell.
     new_cols = []
     for col in kits_df.columns[4:]:
+        long_values = kits_df[col].str.split("-").explode().dropna()
         series = (
-            kits_df[col]
-            .str.split("-")
-            .apply(lambda lst: [int(x) for x in lst] if isinstance(lst, list) else None)
+            pd.to_numeric(long_values)
+            .astype("int64")
+            .groupby(level=0, sort=False)
+            .agg(list)
+            .reindex(kits_df.index)
+            .astype("object")
         )
-        series.name = cast(str, series.name).upper()
+        series[series.isna()] = None
+        series.name = cast(str, col).upper()
         new_cols.append(series)
 
     kits_df = pd.concat(
@@ -280,6 +295,90 @@ def fetch_ftdna(
     echo(f"Kits STR database written to `{kits_str_path}`.")
 
 
+@lru_cache
+def get_confidence_interval(confidence_level: float) -> float:
+    """Two-sided standard score for the given confidence level, computed
+    once per level rather than re-evaluating the inverse CDF per run."""
+
+    from statistics import NormalDist
+
+    return abs(NormalDist().inv_cdf((1.0 - confidence_level) / 2))
+
+
+def get_locus_diff(a: Optional[List[int]], b: Optional[List[int]]) -> List[int]:
+    """Diff two kits' value lists for one multi-copy locus, choosing the
+    pairing of copies that minimizes the total distance.
+
+    The former combination enumeration paired the chosen copies of both
+    kits strictly in order, so the minimum is an order-preserving alignment
+    of the shorter list against the longer one: every copy of the shorter
+    list is matched, skipped copies of the longer list cost one plus their
+    distance to the nearest neighboring copy, and a dynamic program finds
+    the cheapest alignment in O(len(a) * len(b)) instead of enumerating an
+    exponential number of combinations.
+    """
+
+    if a is None or b is None:
+        return []
+
+    def get_val_diff(a: int, b: int) -> int:
+        if a == 0 or b == 0:
+            return 1
+        else:
+            return abs(a - b)
+
+    if len(a) <= len(b):
+        short_vals, long_vals = a, b
+    else:
+        short_vals, long_vals = b, a
+
+    num_short = len(short_vals)
+    num_long = len(long_vals)
+
+    # Penalty for leaving a copy of the longer list unmatched; it depends
+    # only on that copy's neighbors, not on the chosen pairing.
+    penalties = []
+    for i in range(num_long):
+        x = 1000
+        if i > 0:
+            x = min(x, abs(long_vals[i] - long_vals[i - 1]))
+        if i < num_long - 1:
+            x = min(x, abs(long_vals[i] - long_vals[i + 1]))
+        penalties.append(1 + x)
+
+    # cost[s][l]: cheapest alignment of the first s short copies against the
+    # first l long copies. Each long copy is either matched to the next
+    # short copy or skipped at its penalty.
+    inf = float("inf")
+    cost = [[inf] * (num_long + 1) for _ in range(num_short + 1)]
+    cost[0][0] = 0
+    for l in range(1, num_long + 1):
+        cost[0][l] = cost[0][l - 1] + penalties[l - 1]
+    for s in range(1, num_short + 1):
+        for l in range(s, num_long + 1):
+            cost[s][l] = min(
+                cost[s - 1][l - 1]
+                + get_val_diff(short_vals[s - 1], long_vals[l - 1]),
+                cost[s][l - 1] + penalties[l - 1],
+            )
+
+    # Walk the table back to recover the matched diffs and skip penalties.
+    val_diff = []
+    s, l = num_short, num_long
+    while l > 0:
+        if s > 0 and cost[s][l] == cost[s - 1][l - 1] + get_val_diff(
+            short_vals[s - 1], long_vals[l - 1]
+        ):
+            val_diff.append(get_val_diff(short_vals[s - 1], long_vals[l - 1]))
+            s -= 1
+        else:
+            val_diff.append(penalties[l - 1])
+        l -= 1
+
+    val_diff.reverse()
+    return val_diff
+
+
 @app.command()
 def analyze(
     self_kit: str = Option(..., "--kit", "-k", help="The kit to compare against."),
@@ -308,14 +407,14 @@ def analyze(
 
     echo(f"Found {len(kits_df):,} kits in Kits STR database.")
 
-    snps_df = load_db(snps_path)
+    snps_df = load_db(snps_path, columns=["Standard Name"])
     if snps_df is None:
         secho(f"WARNING: SNPs database does not exist.", fg=colors.YELLOW, err=True)
 
     if snps_df is not None:
         echo(f"Found {len(snps_df):,} entries in SNPs database.")
 
-    tree_df = load_db(tree_path)
+    tree_df = load_tree_db()
     if tree_df is None:
         secho(f"WARNING: Tree database does not exist.", fg=colors.YELLOW, err=True)
 
@@ -323,15 +422,12 @@ def analyze(
     self_kit_lineage = get_haplogroup_lineage(tree_df, self_kit_hg)
 
     kits_df = kits_df[
-        kits_df.apply(
-            lambda kit: kit_matches_lineage(
-                tree_df,
-                self_kit_lineage,
-                kit,
-                haplogroup=haplogroup,
-                haplogroup_max_diff=haplogroup_max_diff,
-            ),
-            axis=1,
+        kits_match_lineage(
+            tree_df,
+            self_kit_lineage,
+            kits_df["Haplogroup"],
+            haplogroup=haplogroup,
+            haplogroup_max_diff=haplogroup_max_diff,
         )
     ]
     echo(f"Will compare {len(kits_df.index):,} kits.")
@@ -348,67 +444,36 @@ def analyze(
 
     echo(f"Starting analysis...")
 
-    def get_abs_diffs(kit_s: pd.Series) -> pd.Series:
-        def get_diff(a: List[int], b: List[int]) -> List[int]:
-            if a is None or b is None:
-                return []
-
-            def get_comb_diff(diff: List[Tuple[int, int, int]]) -> List[int]:
-                val_diff = [x for _, _, x in diff]
-
-                for i in set(range(len(a))) - set(i for i, _, _ in diff):
-                    x = 1000
-                    if i > 0:
-                        x = min(x, abs(a[i] - a[i - 1]))
-                    if i < len(a) - 1:
-                        x = min(x, abs(a[i] - a[i + 1]))
-                    val_diff.append(1 + x)
-
-                for j in set(range(len(b))) - set(j for _, j, _ in diff):
-                    x = 1000
-                    if j > 0:
-                        x = min(x, abs(b[j] - b[j - 1]))
-                    if j < len(b) - 1:
-                        x = min(x, abs(b[j] - b[j + 1]))
-                    val_diff.append(1 + x)
-
-                return val_diff
-
-            def get_val_diff(a: int, b: int) -> int:
-                if a == 0 or b == 0:
-                    return 1
-                else:
-                    return abs(a - b)
-
-            min_len = min(len(a), len(b))
-            min_diff = get_comb_diff(
-                min(
-                    (
-                        [
-                            (i, j, get_val_diff(a_val, b_val))
-                            for (i, a_val), (j, b_val) in zip(a_comb, b_comb)
-                        ]
-                        for a_comb in distinct_combinations(enumerate(a), min_len)
-                        for b_comb in distinct_combinations(enumerate(b), min_len)
-                    ),
-                    key=lambda diff: sum(get_comb_diff(diff)),
-                )
-            )
+    rel_dist_cl = Decimal(95) / 100
 
-            return min_diff
+    # Diff all kits against the self kit in one pass over the raw value
+    # matrix, skipping the per-row Series construction of apply(axis=1) and
+    # memoizing each locus's alignments: sibling kits overwhelmingly share
+    # copy lists, so each distinct value list is aligned only once.
+    self_values = list(self_kit_s)
+    num_loci = len(self_values)
+    locus_caches: List[Dict[Tuple[int, ...], List[int]]] = [
+        {} for _ in range(num_loci)
+    ]
 
-        diffs = (get_diff(a, b) for a, b in zip(self_kit_s, kit_s))
-        return pd.Series(flatten(diffs))
+    def get_kit_diffs(kit_values: np.ndarray) -> List[int]:
+        row: List[int] = []
+        for i in range(num_loci):
+            b = kit_values[i]
+            if b is None or self_values[i] is None:
+                continue
 
-    from decimal import Decimal
-    from statistics import NormalDist
+            key = tuple(b)
+            diff = locus_caches[i].get(key)
+            if diff is None:
+                diff = locus_caches[i][key] = get_locus_diff(self_values[i], b)
 
-    def get_confidence_interval(confidence_level: SupportsFloat) -> float:
-        return abs(NormalDist().inv_cdf((1.0 - float(confidence_level)) / 2))
+            row.extend(diff)
 
-    rel_dist_cl = Decimal(95) / 100
+        return row
 
-    loci_diffs = kits_loci_df.apply(lambda kit_s: get_abs_diffs(kit_s), axis=1)
+    diff_rows = [get_kit_diffs(kit_values) for kit_values in kits_loci_df.to_numpy()]
+    loci_diffs = pd.DataFrame(diff_rows, index=kits_loci_df.index, dtype="float64")
     total_num_loci = loci_diffs.shape[1]
     num_comps = loci_diffs.count(axis=1)
     abs_dists = loci_diffs.sum(axis=1)
@@ -420,7 +485,7 @@ def analyze(
         * np.sqrt((total_num_loci - num_comps) / (total_num_loci - 1))
     )
     # Calculate confidence intervals using standard scores.
-    rel_dist_cis = rel_dist_std_errs * get_confidence_interval(rel_dist_cl)
+    rel_dist_cis = rel_dist_std_errs * get_confidence_interval(float(rel_dist_cl))
     rel_dist_mins = rel_dists - rel_dist_cis
     rel_dist_maxs = rel_dists + rel_dist_cis
 
@@ -448,5 +513,8 @@ def analyze(
 
     echo(f"Finished analysis.")
 
-    results_df.sort_values("Relative Distance (max)").to_csv(output_file)
+    # Reorder through argsort + iloc and stream the CSV in chunks, avoiding
+    # a second full copy of the frame at serialization time.
+    order = np.argsort(results_df["Relative Distance (max)"].to_numpy(), kind="stable")
+    results_df.iloc[order].to_csv(output_file, chunksize=50_000)
     echo(f"Analysis written to `{output_file}`.")
@@ -1,14 +1,21 @@
+from __future__ import annotations
+
 import re
+import sys
 import urllib.parse
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from typing import *
 
 import numpy as np
 import pandas as pd
-from bs4 import Tag
-from mechanicalsoup import StatefulBrowser
 from typer_cloup import *
 
+if TYPE_CHECKING:
+    from lxml.html import HtmlElement
+    from requests import Session
+
 from .common import *
 from .db import *
 
@@ -17,7 +24,113 @@ app = Typer()
 
 yfull_tree_url_template = "https://www.yfull.com/tree/{0}/"
 
+
+@lru_cache(maxsize=1)
+def _yfull_session() -> Session:
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    # One keep-alive session per process: repeated subtree downloads reuse
+    # the TLS connection instead of handshaking per request, and compressed
+    # transfer is requested explicitly.
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+_tree_ul_xpath = '//ul[@id = "tree"]'
+_haplogroup_a_xpath = "a[1]"
+
+
+def _span_xpath(css_class: str) -> str:
+    return (
+        f'span[contains(concat(" ", normalize-space(@class), " "),'
+        f' " {css_class} ")][1]'
+    )
+
+
+_compiled_xpaths: Dict[str, Any] = {}
+
+
+def _xpath(expr: str) -> Any:
+    # Compile each XPath expression to its C form once per process; the tree
+    # walk re-applies the same handful of expressions on every <li>.
+    compiled = _compiled_xpaths.get(expr)
+    if compiled is None:
+        from lxml import etree
+
+        compiled = _compiled_xpaths[expr] = etree.XPath(expr)
+
+    return compiled
+
+
 snp_name_pattern = re.compile(r"(?P<name>[A-Z0-9+.=]+)(?P<info>(\([A-Z]+\))*)")
+_snp_name_buffer_pattern = re.compile(
+    r"(?P<name>[A-Z0-9+.=]+)(?P<info>(\([A-Z]+\))*)(?:\n|$)"
+)
+
+
+def _clean_snp(snp: str) -> str:
+    match = snp_name_pattern.fullmatch(snp.upper().strip())
+
+    if match:
+        # SNP names recur across equivalent haplogroups; interning collapses
+        # the duplicates to one object apiece and makes later hash lookups
+        # pointer comparisons.
+        return sys.intern(match.group("name"))
+    else:
+        raise ValueError(f"Invalid SNP '{snp}'.")
+
+
+@lru_cache(maxsize=None)
+def _parse_snps(snps: str) -> Tuple[Tuple[Tuple[str, ...], str], ...]:
+    """Parse a `" * "`-joined SNP list into (names, standard name) groups.
+
+    Equivalent haplogroups repeat the exact same SNP strings, so the parse
+    is cached per unique input; only the first occurrence pays for the
+    tokenizing and regex validation.
+    """
+
+    if not snps:
+        return ()
+
+    multi_snps = [sys.intern(multi_snp) for multi_snp in snps.split(" * ")]
+    token_lists = [
+        [snp.upper().strip() for snp in multi_snp.split("/")]
+        for multi_snp in multi_snps
+    ]
+    tokens = [token for token_list in token_lists for token in token_list]
+
+    # Validate and extract every name in one pass of the regex engine over a
+    # joined buffer rather than one fullmatch call per token. The matches
+    # must tile the buffer exactly; on any gap, the per-token path below
+    # reports the offending SNP as before.
+    buffer = "\n".join(tokens)
+    names: List[str] = []
+    pos = 0
+    for match in _snp_name_buffer_pattern.finditer(buffer):
+        if match.start() != pos:
+            break
+
+        names.append(sys.intern(match.group("name")))
+        pos = match.end()
+
+    if len(names) != len(tokens) or pos < len(buffer):
+        for token in tokens:
+            _clean_snp(token)
+
+        raise ValueError(f"Invalid SNP list '{snps}'.")
+
+    name_iter = iter(names)
+    return tuple(
+        (tuple(islice(name_iter, len(token_list))), multi_snp)
+        for multi_snp, token_list in zip(multi_snps, token_lists)
+    )
+
+
 age_pattern = re.compile(r"formed (?P<age>\d+) ybp, TMRCA (?P<tmrca>\d+) ybp")
 age_bounds_pattern = re.compile(
     r"formed CI (?P<age_cl>\d+)% (?P<age_min>\d+)<->(?P<age_max>\d+) ybp, TMRCA CI (?P<tmrca_cl>\d+)% (?P<tmrca_min>\d+)<->(?P<tmrca_max>\d+) ybp"
@@ -26,74 +139,123 @@ age_bounds_pattern = re.compile(
 
 @app.command()
 def download_yfull(
-    haplogroup: str = Option(
-        ..., "--haplogroup", "--hg", help="The haplogroup of the subtree to download."
+    haplogroups: List[str] = Option(
+        ...,
+        "--haplogroup",
+        "--hg",
+        help="The haplogroup of a subtree to download. May be given multiple times.",
     ),
 ) -> None:
-    """Download a subtree of the Y-haplogroup tree on YFull, and store it."""
-
-    browser = StatefulBrowser()
-
-    url = yfull_tree_url_template.format(urllib.parse.quote(haplogroup))
-    echo(f"Downloading YFull tree from <{url}>...")
-    response = browser.open(url, timeout=60)
-    if not response.ok:
-        secho(
-            f"Haplogroup {haplogroup} not found in YFull tree.", fg=colors.RED, err=True
-        )
-        raise Exit(1)
-
-    echo(f"Finished downloading YFull tree.")
+    """Download subtrees of the Y-haplogroup tree on YFull, and store them."""
+
+    import lxml.html
+
+    def fetch_tree(url: str) -> Optional[HtmlElement]:
+        response = _yfull_session().get(url, timeout=60, stream=True)
+        if not response.ok:
+            return None
+
+        # Feed the decoded response stream straight into lxml's C parser, so
+        # parsing overlaps the download and the document is never buffered
+        # as a Python bytes object first.
+        response.raw.decode_content = True
+        return lxml.html.parse(response.raw).getroot()
+
+    urls = [
+        yfull_tree_url_template.format(urllib.parse.quote(haplogroup))
+        for haplogroup in haplogroups
+    ]
+    for url in urls:
+        echo(f"Downloading YFull tree from <{url}>...")
+
+    # Each subtree download is independent I/O, so fetch and parse them on a
+    # small thread pool; row collection below stays single-threaded.
+    with ThreadPoolExecutor(max_workers=min(4, len(urls))) as executor:
+        page_trees = list(executor.map(fetch_tree, urls))
+
+    for haplogroup, page_tree in zip(haplogroups, page_trees):
+        if page_tree is None:
+            secho(
+                f"Haplogroup {haplogroup} not found in YFull tree.",
+                fg=colors.RED,
+                err=True,
+            )
+            raise Exit(1)
 
     echo(f"Processing YFull tree...")
 
-    tree_ul: Tag = browser.page.select_one("ul#tree")
-
-    found_snps: list[Tuple[str, str]] = []
+    found_snp_names: list[str] = []
+    found_snp_std_names: list[str] = []
 
     def snps_to_list(snps: str) -> List[str]:
-        def clean_snp(snp: str) -> str:
-            match = snp_name_pattern.fullmatch(snp.upper().strip())
-
-            if match:
-                return match.group("name")
-            else:
-                raise ValueError(f"Invalid SNP '{snp}'.")
-
-        if not snps:
-            return []
-
         all_snps_list = []
-        multi_snps_list = [snp for snp in snps.split(" * ")]
-        for multi_snp in multi_snps_list:
-            snps_list = [clean_snp(snp) for snp in multi_snp.split("/")]
+        for snps_list, multi_snp in _parse_snps(snps):
             all_snps_list.extend(snps_list)
 
             for snp in snps_list:
-                found_snps.append((snp, multi_snp))
+                found_snp_names.append(snp)
+                found_snp_std_names.append(multi_snp)
 
         return all_snps_list
 
-    def traverse_tree(
-        tree_ul: Tag, parent_haplogroup: Optional[str] = None
-    ) -> Iterable[pd.Series]:
-        item_li_list: list[Tag] = tree_ul.select(":scope > li")
-        for item_li in item_li_list:
-            haplogroup_a: Tag = item_li.select_one(":scope > a")
-            if haplogroup_a is None:
+    # Resolve the compiled XPath callables once; the walk below applies them
+    # to every <li> and should not rebuild expression strings or hit the
+    # compile cache per node.
+    xpath_haplogroup_a = _xpath(_haplogroup_a_xpath)
+    xpath_snp_span = _xpath(_span_xpath("yf-snpforhg"))
+    xpath_plus_snp_span = _xpath(_span_xpath("yf-plus-snps"))
+    xpath_age_span = _xpath(_span_xpath("yf-age"))
+
+    def select_span(item_li: HtmlElement, span_xpath: Any) -> Optional[HtmlElement]:
+        spans = span_xpath(item_li)
+        return spans[0] if spans else None
+
+    # Rows are collected column by column so the DataFrame below is built
+    # straight from ready-made columns, with no row-to-column transpose or
+    # per-row dtype inference.
+    tree_columns: Dict[str, List[Any]] = {
+        "Haplogroup": [],
+        "Parent Haplogroup": [],
+        "Primary SNPs": [],
+        "Extra SNPs": [],
+        "Age (ybp)": [],
+        "Age (CL%)": [],
+        "Age (min, ybp)": [],
+        "Age (max, ybp)": [],
+        "TMRCA (ybp)": [],
+        "TMRCA (CL%)": [],
+        "TMRCA (min, ybp)": [],
+        "TMRCA (max, ybp)": [],
+    }
+
+    def traverse_tree(tree_ul: HtmlElement) -> None:
+        # Iterative preorder walk: children are pushed in reverse so each
+        # node's subtree pops before its next sibling, matching the order a
+        # recursive traversal would emit without a Python frame per node.
+        stack: list[Tuple[HtmlElement, Optional[str]]] = [
+            (item_li, None) for item_li in reversed(tree_ul.findall("li"))
+        ]
+        while stack:
+            item_li, parent_haplogroup = stack.pop()
+
+            haplogroup_a_list = xpath_haplogroup_a(item_li)
+            if not haplogroup_a_list:
                 continue
 
-            snp_span: Tag = item_li.select_one(":scope > span.yf-snpforhg")
-            plus_snp_span: Tag = item_li.select_one(":scope > span.yf-plus-snps")
-            age_span: Tag = item_li.select_one(":scope > span.yf-age")
-            inner_ul: Tag = item_li.select_one(":scope > ul")
+            snp_span = select_span(item_li, xpath_snp_span)
+            plus_snp_span = select_span(item_li, xpath_plus_snp_span)
+            age_span = select_span(item_li, xpath_age_span)
+            inner_ul = item_li.find("ul")
 
-            haplogroup = haplogroup_a.text
+            # The anchor and spans are leaf elements holding a single text
+            # node, so .text reads it directly instead of walking a subtree.
+            # Interned, since every child row repeats its parent's name.
+            haplogroup = sys.intern(haplogroup_a_list[0].text or "")
 
-            primary_snps = snps_to_list(snp_span.text)
+            primary_snps = snps_to_list(snp_span.text or "")
 
             if plus_snp_span is not None:
-                extra_snps = snps_to_list(plus_snp_span["title"])
+                extra_snps = snps_to_list(plus_snp_span.get("title"))
             else:
                 extra_snps = []
 
@@ -106,25 +268,43 @@ def download_yfull(
             tmrca_min = None
             tmrca_max = None
             if age_span is not None:
-                age_text = age_span.text
-                age_match = age_pattern.fullmatch(age_text)
-                if age_match:
-                    age = int(age_match.group("age"))
-                    tmrca = int(age_match.group("tmrca"))
+                # The age text has the fixed shape "formed N ybp, TMRCA M
+                # ybp"; a split plus two int conversions is much cheaper than
+                # a regex match per node. The regex stays as a fallback so
+                # any deviating text is still parsed or warned about as
+                # before.
+                age_text = age_span.text or ""
+                age_parts = age_text.split()
+                if (
+                    len(age_parts) == 6
+                    and age_parts[0] == "formed"
+                    and age_parts[2] == "ybp,"
+                    and age_parts[3] == "TMRCA"
+                    and age_parts[5] == "ybp"
+                    and age_parts[1].isdigit()
+                    and age_parts[4].isdigit()
+                ):
+                    age = int(age_parts[1])
+                    tmrca = int(age_parts[4])
                 else:
-                    secho(
-                        f"WARNING: unexpected format of text for haplogroup age: '{age_text}'",
-                        fg=colors.YELLOW,
-                        err=True,
-                    )
-
-                age_bounds_text = age_span["title"]
+                    age_match = age_pattern.fullmatch(age_text)
+                    if age_match:
+                        age = int(age_match.group("age"))
+                        tmrca = int(age_match.group("tmrca"))
+                    else:
+                        secho(
+                            f"WARNING: unexpected format of text for haplogroup age: '{age_text}'",
+                            fg=colors.YELLOW,
+                            err=True,
+                        )
+
+                age_bounds_text = age_span.get("title")
                 age_bounds_match = age_bounds_pattern.fullmatch(age_bounds_text)
                 if age_bounds_match:
-                    age_cl = Decimal(int(age_bounds_match.group("age_cl"))) / 100
+                    age_cl = int(age_bounds_match.group("age_cl"))
                     age_min = int(age_bounds_match.group("age_min"))
                     age_max = int(age_bounds_match.group("age_max"))
-                    tmrca_cl = Decimal(int(age_bounds_match.group("tmrca_cl"))) / 100
+                    tmrca_cl = int(age_bounds_match.group("tmrca_cl"))
                     tmrca_min = int(age_bounds_match.group("tmrca_min"))
                     tmrca_max = int(age_bounds_match.group("tmrca_max"))
                 else:
@@ -134,7 +314,7 @@ def download_yfull(
                         err=True,
                     )
 
-            yield [
+            row = (
                 haplogroup,
                 parent_haplogroup,
                 primary_snps,
@@ -147,45 +327,49 @@ def download_yfull(
                 tmrca_cl,
                 tmrca_min,
                 tmrca_max,
-            ]
+            )
+            for column, value in zip(tree_columns.values(), row):
+                column.append(value)
 
             if inner_ul is not None:
-                yield from traverse_tree(inner_ul, haplogroup)
-
-    haplogroups = traverse_tree(tree_ul)
-    tree_df = pd.DataFrame(
-        haplogroups,
-        columns=[
-            "Haplogroup",
-            "Parent Haplogroup",
-            "Primary SNPs",
-            "Extra SNPs",
-            "Age (ybp)",
-            "Age (CL%)",
-            "Age (min, ybp)",
-            "Age (max, ybp)",
-            "TMRCA (ybp)",
-            "TMRCA (CL%)",
-            "TMRCA (min, ybp)",
-            "TMRCA (max, ybp)",
-        ],
-    )
+                stack.extend(
+                    (child_li, haplogroup)
+                    for child_li in reversed(inner_ul.findall("li"))
+                )
+
+    for page_tree in page_trees:
+        tree_ul: Optional[HtmlElement] = next(
+            iter(_xpath(_tree_ul_xpath)(page_tree)), None
+        )
+        traverse_tree(tree_ul)
+
+    # Wrap the age columns as nullable Int32 up front; casting them after
+    # construction would re-materialize each column a second time.
+    for int_column in (
+        "Age (ybp)",
+        "Age (min, ybp)",
+        "Age (max, ybp)",
+        "TMRCA (ybp)",
+        "TMRCA (min, ybp)",
+        "TMRCA (max, ybp)",
+    ):
+        tree_columns[int_column] = pd.array(tree_columns[int_column], dtype="Int32")
+
+    # Confidence levels are whole percentages (68, 95), stored as such; one
+    # byte per value instead of a float64.
+    for cl_column in ("Age (CL%)", "TMRCA (CL%)"):
+        tree_columns[cl_column] = pd.array(tree_columns[cl_column], dtype="UInt8")
+
+    tree_df = pd.DataFrame(tree_columns, copy=False)
     tree_df.set_index("Haplogroup", inplace=True)
 
-    tree_df["Age (ybp)"] = tree_df["Age (ybp)"].astype("Int32")
-    tree_df["Age (min, ybp)"] = tree_df["Age (min, ybp)"].astype("Int32")
-    tree_df["Age (max, ybp)"] = tree_df["Age (max, ybp)"].astype("Int32")
-    tree_df["TMRCA (ybp)"] = tree_df["TMRCA (ybp)"].astype("Int32")
-    tree_df["TMRCA (min, ybp)"] = tree_df["TMRCA (min, ybp)"].astype("Int32")
-    tree_df["TMRCA (max, ybp)"] = tree_df["TMRCA (max, ybp)"].astype("Int32")
-
+    # Deduplicate up front rather than shipping colliding index rows to the
+    # database merge; keep="last" matches the keep-last semantics the merge
+    # would have applied.
     snps_df = pd.DataFrame(
-        found_snps,
-        columns=[
-            "SNP",
-            "Standard Name",
-        ],
+        {"SNP": found_snp_names, "Standard Name": found_snp_std_names}, copy=False
     )
+    snps_df.drop_duplicates("SNP", keep="last", inplace=True)
     snps_df.set_index("SNP", inplace=True)
 
     echo(f"Finished processing YFull tree.")
@@ -212,10 +396,14 @@ def prune_tree(
 
     echo(f"Found {len(tree_df):,} haplogroups in tree database.")
 
+    # Match the index in one vectorized pass with the precompiled pattern;
+    # `filter(regex=...)` would re-enter the regex machinery per label.
     haplogroups_pattern = re.compile(haplogroups, re.RegexFlag.IGNORECASE)
-    pruned_tree_df = tree_df.filter(regex=haplogroups_pattern, axis=0)
+    pruned_tree_df = tree_df.loc[
+        tree_df.index.str.contains(haplogroups_pattern, na=False)
+    ]
 
-    retained_fraction = Decimal(len(pruned_tree_df)) / len(tree_df)
+    retained_fraction = len(pruned_tree_df) / len(tree_df)
     echo(
         f"Pruned tree has {len(tree_df):,} haplogroups ({retained_fraction:.1%} retained)."
     )
@@ -252,7 +440,7 @@ def hg(
 ) -> None:
     """Get information about a haplogroup in the tree."""
 
-    tree_df = load_db(tree_path)
+    tree_df = load_tree_db()
     if tree_df is None:
         secho(f"ERROR: Tree database does not exist.", fg=colors.RED, err=True)
         raise Exit(1)